@@ -0,0 +1,95 @@
+"""parse_cmoa_html の解析方法ごとの速度とメモリ使用量を比較するベンチマーク
+
+benchmarks/fixtures/cmoa/ に保存した作品ページを各解析方法で解析し、
+  - 1ページあたりの解析時間
+  - 解析中のピークメモリ（tracemalloc）
+  - 従来の html.parser と同じ結果になるか
+を表示する。lxml はインストールされている場合のみ計測する。
+
+フィクスチャは実際に保存したページではなく、コミックシーモアの作品ページの構造を再現し、
+CSSのルールなどで大きさを水増しした合成ページのため、計測値は合成データでの目安として扱う。
+実際のページで計測する場合は、保存したHTMLのディレクトリを --fixtures で指定する。
+
+実行方法: python benchmarks/bench_cmoa_parser.py [--repeat 20] [--fixtures DIR]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+PARSERS = ["html.parser", "lxml", "strained"]
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cmoa")
+
+
+def load_fixtures(directory):
+    """フィクスチャのHTMLを読み込む"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+
+def measure(parser, fixtures, repeat):
+    """1つの解析方法について、時間・ピークメモリ・結果を計測する"""
+    results = {name: main.parse_cmoa_html(html, parser) for name, html in fixtures.items()}
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for html in fixtures.values():
+            main.parse_cmoa_html(html, parser)
+    per_page_ms = (time.perf_counter() - started) / (repeat * len(fixtures)) * 1000
+
+    peak_mb = 0.0
+    for html in fixtures.values():
+        tracemalloc.start()
+        main.parse_cmoa_html(html, parser)
+        peak_mb = max(peak_mb, tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+        tracemalloc.stop()
+
+    return per_page_ms, peak_mb, results
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="解析するHTMLのディレクトリ（既定: 合成フィクスチャ）")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"フィクスチャが見つかりません: {args.fixtures}")
+        return 1
+    average_kb = sum(len(html.encode("utf-8")) for html in fixtures.values()) / len(fixtures) / 1024
+    label = "合成フィクスチャ" if os.path.abspath(args.fixtures) == DEFAULT_FIXTURES else "フィクスチャ"
+    print(f"\n{label}: {len(fixtures)}ページ（平均 {average_kb:.0f}KB）、各{args.repeat}回")
+
+    reference = None
+    mismatches = 0
+    print(f"{'解析方法':<12} {'時間(ms/ページ)':>16} {'ピーク(MB)':>12} {'結果':>8}")
+    for name in PARSERS:
+        if not main.cmoa_parser_available(name):
+            print(f"{name:<12} {'-':>16} {'-':>12} {'未インストール':>8}")
+            continue
+        per_page_ms, peak_mb, results = measure(name, fixtures, args.repeat)
+        if reference is None:
+            reference = results
+        same = results == reference
+        if not same:
+            mismatches += 1
+            for fixture, result in results.items():
+                if result != reference[fixture]:
+                    print(f"  {fixture}: {result} != {reference[fixture]}")
+        print(f"{name:<12} {per_page_ms:>16.2f} {peak_mb:>12.2f} {'一致' if same else '不一致':>8}")
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,138 @@
+"""main.py をローカルの代替サーバーに対して実行するエンドツーエンドのベンチマーク
+
+行数ごとに合成したデータベース（既定: 1k / 10k / 50k 行）を FakeNotionServer で、
+作品ページを CmoaFixtureServer で配信し、main.py を別プロセスで全件チェックとして実行する。
+各実行について
+  - 全体の処理時間と ページ/秒（更新したページ数 / 処理時間）
+  - ステージごと（Notionの各API・cmoa取得・HTML解析）のレイテンシ p50 / p95
+  - 代替サーバーが受けたリクエスト数と 429 の数
+を表示する。ステージごとのレイテンシは main.py が出力する実行レポート（RUN_REPORT_PATH）から読み取る。
+結果は --json でファイルにも保存できる。
+
+実行方法: python benchmarks/bench_e2e.py [--sizes 1000,10000,50000] [--target-ratio 0.05]
+          [--notion-latency-ms 30] [--cmoa-latency-ms 80] [--rate-429 0.01] [--concurrency 4]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_SCRIPT = os.path.join(BENCH_DIR, "..", "main.py")
+sys.path.insert(0, BENCH_DIR)
+
+from fake_servers import DATABASE_ID, CmoaFixtureServer, FakeNotionDatabase, FakeNotionServer  # noqa: E402
+
+STAGES = [
+    "notion.retrieve_database",
+    "notion.retrieve_data_source",
+    "notion.query",
+    "cmoa.fetch",
+    "cmoa.parse",
+    "notion.update",
+]
+
+
+def run_scenario(rows, args):
+    """代替サーバーを起動し、別プロセスで main.py を実行して結果をまとめる"""
+    cmoa = CmoaFixtureServer(latency_ms=args.cmoa_latency_ms, seed=args.seed).start()
+    database = FakeNotionDatabase(rows, args.target_ratio, cmoa.base_url, seed=args.seed)
+    notion = FakeNotionServer(database, latency_ms=args.notion_latency_ms, rate_429=args.rate_429,
+                              retry_after=args.retry_after, seed=args.seed).start()
+    targets = sum(1 for row in database.rows if row["url"] and not row["synopsis"])
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report_file = os.path.join(work_dir, "run_report.json")
+            env = dict(
+                os.environ,
+                NOTION_API_KEY="bench",
+                DATABASE_ID=DATABASE_ID,
+                NOTION_API_BASE=notion.api_base,
+                SYNC_CONCURRENCY=str(args.concurrency),
+                NOTION_RATE_PER_SEC=str(args.notion_rate),
+                CMOA_RATE_PER_SEC=str(args.cmoa_rate),
+                MAX_QUERY_PAGES=str(rows // 100 + 10),
+                MAX_TARGET_PAGES=str(rows + 1),
+                SCRAPE_CACHE_PATH=os.path.join(work_dir, "scrape_cache.sqlite3"),
+                RETRY_QUEUE_PATH=os.path.join(work_dir, "retry_queue.json"),
+                SYNC_STATE_PATH=os.path.join(work_dir, "sync_state.json"),
+                SCHEMA_CACHE_PATH=os.path.join(work_dir, "notion_schema.json"),
+                RUN_REPORT_PATH=report_file,
+            )
+            log_path = os.path.join(args.log_dir, f"bench_e2e_{rows}.log") if args.log_dir else os.devnull
+            with open(log_path, "w", encoding="utf-8") as log:
+                started = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, MAIN_SCRIPT, "--full-scan"],
+                    env=env, stdout=log, stderr=subprocess.STDOUT, check=True,
+                )
+                process_seconds = time.perf_counter() - started
+            with open(report_file, encoding="utf-8") as f:
+                report = json.load(f)
+    finally:
+        notion.stop()
+        cmoa.stop()
+
+    updated = notion.stats.get("update_page", 0)
+    return {
+        "rows": rows,
+        "targets": targets,
+        "updated": updated,
+        "wall_seconds": report["wall_seconds"],
+        "process_seconds": process_seconds,
+        "pages_per_second": updated / report["wall_seconds"] if report["wall_seconds"] > 0 else 0,
+        "stages": {
+            stage: {key: data[key] for key in ("count", "p50_ms", "p95_ms")}
+            for stage, data in report["stages"].items()
+        },
+        "notion_requests": notion.stats,
+        "cmoa_requests": cmoa.stats,
+    }
+
+
+def print_result(result):
+    print(f"\n=== {result['rows']:,}行（対象 {result['targets']:,}件） ===")
+    print(f"更新: {result['updated']:,}件、処理時間: {result['wall_seconds']:.1f}秒 "
+          f"（プロセス起動を含む {result['process_seconds']:.1f}秒）、{result['pages_per_second']:.1f}ページ/秒")
+    print(f"{'ステージ':<28} {'回数':>8} {'p50(ms)':>10} {'p95(ms)':>10}")
+    for stage in STAGES + sorted(set(result["stages"]) - set(STAGES)):
+        if stage in result["stages"]:
+            s = result["stages"][stage]
+            print(f"{stage:<28} {s['count']:>8} {s['p50_ms']:>10.1f} {s['p95_ms']:>10.1f}")
+    print(f"Notion代替サーバー: {result['notion_requests']}")
+    print(f"cmoa代替サーバー: {result['cmoa_requests']}")
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="カンマ区切りの行数")
+    parser.add_argument("--target-ratio", type=float, default=0.05, help="処理対象（URLあり + あらすじ空）の行の割合")
+    parser.add_argument("--notion-latency-ms", type=float, default=30.0)
+    parser.add_argument("--cmoa-latency-ms", type=float, default=80.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Notion代替サーバーが429を返す割合")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429に付けるRetry-Afterの秒数")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--notion-rate", type=float, default=0.0, help="main.py のNotionのレート制限（0で無制限）")
+    parser.add_argument("--cmoa-rate", type=float, default=0.0, help="main.py のcmoaのレート制限（0で無制限）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-dir", help="main.py の出力を保存するディレクトリ")
+    parser.add_argument("--json", help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    results = []
+    for rows in [int(size) for size in args.sizes.split(",") if size]:
+        result = run_scenario(rows, args)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,128 @@
+"""クエリ結果の保持方法によるメモリ使用量とJSONデコード時間を比較するベンチマーク
+
+合成した5000件（100件 x 50リクエスト）のクエリレスポンスを使い、
+  - full: 全プロパティを含むページJSONをそのまま保持する（従来の方法）
+  - projected: filter_properties で絞り込んだレスポンスを PageRecord に変換して保持する
+を比較する。
+
+実行方法: python benchmarks/bench_page_records.py [--pages 5000] [--extra-properties 30]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+# 既定のプロパティ名を使うデータベース
+DATABASE = main.DatabaseConfig("bench", "bench", "", {})
+
+
+def make_page(i, extra_properties, projected):
+    """合成したページJSONを1件作成する"""
+    properties = {
+        "URL": {"id": "u%3D1", "type": "url", "url": f"https://www.cmoa.jp/title/{100000 + i}/"},
+        "タイトル": {"id": "title", "type": "title", "title": [
+            {"type": "text", "text": {"content": f"作品{i}", "link": None}, "plain_text": f"作品{i}", "href": None}
+        ]},
+        "あらすじ": {"id": "s%3E2", "type": "rich_text", "rich_text": []},
+        "ジャンル": {"id": "genr", "type": "multi_select", "multi_select": [
+            {"id": f"genre-{k}", "name": f"ジャンル{k}", "color": "default"} for k in range(2)
+        ]},
+        "雑誌・レーベル": {"id": "magz", "type": "multi_select", "multi_select": [
+            {"id": "magazine-0", "name": "雑誌0", "color": "default"}
+        ]},
+        "タグ": {"id": "tags", "type": "multi_select", "multi_select": [
+            {"id": f"tag-{k}", "name": f"タグ{k}", "color": "default"} for k in range(3)
+        ]},
+    }
+    if not projected:
+        for n in range(extra_properties):
+            if n % 3 == 0:
+                properties[f"プロパティ{n}"] = {"id": f"p{n}", "type": "multi_select", "multi_select": [
+                    {"id": f"opt-{n}-{k}", "name": f"タグ{k}", "color": "default"} for k in range(4)
+                ]}
+            elif n % 3 == 1:
+                properties[f"プロパティ{n}"] = {"id": f"p{n}", "type": "rich_text", "rich_text": [
+                    {"type": "text", "text": {"content": "テキスト" * 10, "link": None}, "plain_text": "テキスト" * 10, "href": None}
+                ]}
+            else:
+                properties[f"プロパティ{n}"] = {"id": f"p{n}", "type": "number", "number": i * n}
+    return {
+        "object": "page",
+        "id": f"00000000-0000-0000-0000-{i:012d}",
+        "created_time": "2025-01-01T00:00:00.000Z",
+        "last_edited_time": "2025-01-01T00:00:00.000Z",
+        "archived": False,
+        "properties": properties,
+        "url": f"https://www.notion.so/{i:032d}",
+    }
+
+
+def make_responses(total_pages, extra_properties, projected):
+    """100件ずつのクエリレスポンスをJSON文字列として作成する"""
+    responses = []
+    for start in range(0, total_pages, 100):
+        results = [make_page(i, extra_properties, projected) for i in range(start, min(start + 100, total_pages))]
+        responses.append(json.dumps({"object": "list", "results": results, "has_more": False, "next_cursor": None}))
+    return responses
+
+
+def load(responses, project):
+    """レスポンスをデコードし、保持するオブジェクトのリストを返す"""
+    held = []
+    for body in responses:
+        data = json.loads(body)
+        if project:
+            held.extend(main.to_page_record(page, DATABASE) for page in data.get("results", []))
+        else:
+            held.extend(data.get("results", []))
+    return held
+
+
+def measure(responses, project):
+    """レスポンスをデコードして保持したときの時間とメモリを計測する"""
+    # 時間はtracemallocのオーバーヘッドを含めずに計測する
+    gc.collect()
+    started = time.perf_counter()
+    held = load(responses, project)
+    elapsed = time.perf_counter() - started
+    del held
+
+    gc.collect()
+    tracemalloc.start()
+    held = load(responses, project)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"pages": len(held), "seconds": elapsed, "retained_mb": current / 1024 / 1024, "peak_mb": peak / 1024 / 1024}
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--extra-properties", type=int, default=30)
+    args = parser.parse_args()
+
+    full_responses = make_responses(args.pages, args.extra_properties, projected=False)
+    projected_responses = make_responses(args.pages, args.extra_properties, projected=True)
+
+    results = {
+        "full": measure(full_responses, project=False),
+        "projected": measure(projected_responses, project=True),
+    }
+
+    print(f"\n合成データ: {args.pages}ページ、追加プロパティ {args.extra_properties}個")
+    print(f"{'方式':<10} {'転送量(MB)':>10} {'デコード(秒)':>12} {'保持(MB)':>10} {'ピーク(MB)':>10}")
+    for name, responses in (("full", full_responses), ("projected", projected_responses)):
+        size_mb = sum(len(body.encode("utf-8")) for body in responses) / 1024 / 1024
+        r = results[name]
+        print(f"{name:<10} {size_mb:>10.2f} {r['seconds']:>12.3f} {r['retained_mb']:>10.2f} {r['peak_mb']:>10.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,448 @@
+"""ベンチマーク用のローカルHTTPサーバー（Notion APIの代替とコミックシーモアのフィクスチャ配信）
+
+FakeNotionServer は main.py が使う以下のエンドポイントを、合成したデータベースで再現する。
+  - GET   /v1/databases/{id}
+  - GET   /v1/data_sources/{id}
+  - POST  /v1/data_sources/{id}/query （filter・sorts・filter_properties・ページネーション）
+  - GET   /v1/pages/{id}
+  - PATCH /v1/pages/{id}
+応答の遅延と、一定の割合で 429 (Retry-After付き) を返す設定ができる。
+
+CmoaFixtureServer は /title/{番号}/ に benchmarks/fixtures/cmoa/ のHTMLを返す（ETagによる304にも対応）。
+
+単体で起動すると、main.py を手動で実行するための環境変数を表示して待機する。
+実行方法: python benchmarks/fake_servers.py [--rows 1000] [--target-ratio 0.05]
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cmoa")
+
+DATABASE_ID = "bench-database"
+DATA_SOURCE_ID = "bench-data-source"
+
+# 代替データソースのスキーマ（プロパティ名 -> (プロパティID, タイプ)）
+SCHEMA = {
+    "ID": ("idnm", "unique_id"),
+    "タイトル": ("title", "title"),
+    "URL": ("urlp", "url"),
+    "あらすじ": ("synp", "rich_text"),
+    "ジャンル": ("genr", "multi_select"),
+    "雑誌・レーベル": ("magz", "multi_select"),
+    "タグ": ("tags", "multi_select"),
+    "メモ": ("memo", "rich_text"),
+    "評価": ("rate", "number"),
+    "読了日": ("done", "date"),
+}
+
+
+class ValidationError(Exception):
+    """Notion APIの validation_error (400) に相当するエラー"""
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def rich_text(content):
+    if not content:
+        return []
+    return [{"type": "text", "text": {"content": content, "link": None}, "plain_text": content, "href": None}]
+
+
+class FakeNotionDatabase:
+    """合成した行を保持し、クエリと更新を処理するインメモリのデータベース"""
+
+    def __init__(self, rows, target_ratio, cmoa_base_url, seed=0):
+        rng = random.Random(seed)
+        base_time = datetime.now(timezone.utc) - timedelta(days=30)
+        self._lock = threading.Lock()
+        self.rows = []
+        self.rows_by_id = {}
+        for number in range(1, rows + 1):
+            created = base_time + timedelta(seconds=number * 30 * 24 * 3600 // max(rows, 1))
+            is_target = rng.random() < target_ratio
+            row = {
+                "id": f"{number:08x}-0000-4000-8000-{number:012x}",
+                "number": number,
+                "title": f"作品{number}",
+                "url": f"{cmoa_base_url}/title/{100000 + number}/" if is_target or rng.random() < 0.7 else None,
+                "synopsis": "" if is_target else f"作品{number}のあらすじ",
+                "genres": [] if is_target else ["少年"],
+                "magazine": [],
+                "tags": [],
+                "memo": "メモ" * (number % 20),
+                "created_time": created,
+                "last_edited_time": created,
+            }
+            self.rows.append(row)
+            self.rows_by_id[row["id"]] = row
+
+    def property_value(self, row, name):
+        """行の値をNotion APIのプロパティ値の形式で返す"""
+        property_id, property_type = SCHEMA[name]
+        if name == "ID":
+            value = {"prefix": None, "number": row["number"]}
+        elif name == "タイトル":
+            value = rich_text(row["title"])
+        elif name == "URL":
+            value = row["url"]
+        elif name == "あらすじ":
+            value = rich_text(row["synopsis"])
+        elif name in ("ジャンル", "雑誌・レーベル", "タグ"):
+            key = {"ジャンル": "genres", "雑誌・レーベル": "magazine", "タグ": "tags"}[name]
+            value = [{"id": f"opt-{option}", "name": option, "color": "default"} for option in row[key]]
+        elif name == "メモ":
+            value = rich_text(row["memo"])
+        elif name == "評価":
+            value = row["number"] % 5
+        else:
+            value = {"start": iso(row["created_time"])[:10], "end": None, "time_zone": None}
+        return {"id": property_id, "type": property_type, property_type: value}
+
+    def page_json(self, row, property_ids=None):
+        """行をNotion APIのページオブジェクトに変換する"""
+        properties = {
+            name: self.property_value(row, name)
+            for name, (property_id, _) in SCHEMA.items()
+            if not property_ids or property_id in property_ids
+        }
+        return {
+            "object": "page",
+            "id": row["id"],
+            "created_time": iso(row["created_time"]),
+            "last_edited_time": iso(row["last_edited_time"]),
+            "archived": False,
+            "in_trash": False,
+            "parent": {"type": "data_source_id", "data_source_id": DATA_SOURCE_ID, "database_id": DATABASE_ID},
+            "properties": properties,
+            "url": f"https://www.notion.so/{row['id'].replace('-', '')}",
+        }
+
+    def matches(self, row, condition):
+        """クエリのフィルタ条件に行が一致するかを判定する"""
+        if "and" in condition:
+            return all(self.matches(row, c) for c in condition["and"])
+        if "or" in condition:
+            return any(self.matches(row, c) for c in condition["or"])
+        if "timestamp" in condition:
+            timestamp = condition["timestamp"]
+            value = row[timestamp]
+            for operator, operand in condition[timestamp].items():
+                operand = parse_iso(operand)
+                if operator == "on_or_after" and not value >= operand:
+                    return False
+                if operator == "after" and not value > operand:
+                    return False
+                if operator == "before" and not value < operand:
+                    return False
+                if operator == "on_or_before" and not value <= operand:
+                    return False
+            return True
+        name = condition.get("property")
+        if name not in SCHEMA:
+            raise ValidationError(f"Could not find property with name or id: {name}")
+        property_type = SCHEMA[name][1]
+        if property_type not in condition:
+            raise ValidationError(f"{name} is expected to be {property_type}.")
+        value = {
+            "ID": row["number"],
+            "URL": row["url"],
+            "あらすじ": row["synopsis"],
+            "タイトル": row["title"],
+            "メモ": row["memo"],
+        }.get(name)
+        for operator, operand in condition[property_type].items():
+            if operator == "is_empty" and value:
+                return False
+            if operator == "is_not_empty" and not value:
+                return False
+            if operator == "equals" and value != operand:
+                return False
+            if operator == "greater_than" and not value > operand:
+                return False
+            if operator == "greater_than_or_equal_to" and not value >= operand:
+                return False
+            if operator == "less_than" and not value < operand:
+                return False
+            if operator == "less_than_or_equal_to" and not value <= operand:
+                return False
+        return True
+
+    def query(self, body, property_ids):
+        """データソースクエリを処理する（カーソルは最後に返した行のID番号）"""
+        page_size = min(int(body.get("page_size", 100)), 100)
+        condition = body.get("filter") or {}
+        descending = False
+        for sort in body.get("sorts", []):
+            if sort.get("property") not in (None, "ID"):
+                raise ValidationError(f"Unsupported sort property: {sort.get('property')}")
+            descending = sort.get("direction") == "descending"
+        cursor = body.get("start_cursor")
+        with self._lock:
+            rows = reversed(self.rows) if descending else iter(self.rows)
+            results = []
+            has_more = False
+            for row in rows:
+                if cursor is not None:
+                    if descending and row["number"] >= int(cursor):
+                        continue
+                    if not descending and row["number"] <= int(cursor):
+                        continue
+                if condition and not self.matches(row, condition):
+                    continue
+                if len(results) == page_size:
+                    has_more = True
+                    break
+                results.append(self.page_json(row, property_ids))
+        return {
+            "object": "list",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": str(int(results[-1]["id"][:8], 16)) if has_more else None,
+        }
+
+    def update(self, page_id, properties):
+        """ページのプロパティを更新する"""
+        with self._lock:
+            row = self.rows_by_id.get(page_id)
+            if row is None:
+                return None
+            for name, prop in properties.items():
+                if name not in SCHEMA:
+                    raise ValidationError(f"{name} is not a property that exists.")
+                if "rich_text" in prop:
+                    row[{"あらすじ": "synopsis", "メモ": "memo"}[name]] = "".join(
+                        t.get("text", {}).get("content", "") for t in prop["rich_text"])
+                elif "multi_select" in prop:
+                    key = {"ジャンル": "genres", "雑誌・レーベル": "magazine", "タグ": "tags"}[name]
+                    row[key] = [option["name"] for option in prop["multi_select"]]
+            row["last_edited_time"] = datetime.now(timezone.utc)
+            return self.page_json(row)
+
+    def get(self, page_id):
+        with self._lock:
+            row = self.rows_by_id.get(page_id)
+            return self.page_json(row) if row else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.app.count("bytes_sent", len(body))
+
+
+class _NotionHandler(_Handler):
+    def handle_request(self, method):
+        app = self.server.app
+        parsed = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        parts = [part for part in parsed.path.split("/") if part]
+        app.wait_latency()
+        if app.should_throttle():
+            app.count("throttled")
+            self.send_body(429, {"object": "error", "status": 429, "code": "rate_limited",
+                                 "message": "You have been rate limited."},
+                           headers={"Retry-After": f"{app.retry_after:g}"})
+            return
+        try:
+            if method == "GET" and parts[:2] == ["v1", "databases"] and len(parts) == 3:
+                app.count("retrieve_database")
+                self.send_body(200, {"object": "database", "id": parts[2],
+                                     "title": [{"type": "text", "plain_text": "ベンチマーク用データベース"}],
+                                     "data_sources": [{"id": DATA_SOURCE_ID, "name": "ベンチマーク"}]})
+            elif method == "GET" and parts[:2] == ["v1", "data_sources"] and len(parts) == 3:
+                app.count("retrieve_data_source")
+                properties = {name: {"id": pid, "name": name, "type": ptype, ptype: {}}
+                              for name, (pid, ptype) in SCHEMA.items()}
+                self.send_body(200, {"object": "data_source", "id": parts[2], "properties": properties})
+            elif method == "POST" and parts[:2] == ["v1", "data_sources"] and parts[3:] == ["query"]:
+                app.count("query")
+                if parts[2] != DATA_SOURCE_ID:
+                    self.send_body(404, {"object": "error", "status": 404, "code": "object_not_found",
+                                         "message": f"Could not find data_source with ID: {parts[2]}."})
+                    return
+                property_ids = set(parse_qs(parsed.query).get("filter_properties", []))
+                unknown = property_ids - {pid for pid, _ in SCHEMA.values()}
+                if unknown:
+                    raise ValidationError(f"Could not find property with ID: {sorted(unknown)[0]}")
+                self.send_body(200, app.database.query(body, property_ids))
+            elif parts[:2] == ["v1", "pages"] and len(parts) == 3 and method in ("GET", "PATCH"):
+                if method == "GET":
+                    app.count("retrieve_page")
+                    page = app.database.get(parts[2])
+                else:
+                    app.count("update_page")
+                    page = app.database.update(parts[2], body.get("properties", {}))
+                if page is None:
+                    self.send_body(404, {"object": "error", "status": 404, "code": "object_not_found",
+                                         "message": f"Could not find page with ID: {parts[2]}."})
+                else:
+                    self.send_body(200, page)
+            else:
+                self.send_body(404, {"object": "error", "status": 404, "code": "invalid_request_url",
+                                     "message": "Invalid request URL."})
+        except ValidationError as e:
+            app.count("validation_error")
+            self.send_body(400, {"object": "error", "status": 400, "code": "validation_error", "message": str(e)})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+
+class _CmoaHandler(_Handler):
+    def do_GET(self):
+        app = self.server.app
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        app.wait_latency()
+        if len(parts) != 2 or parts[0] != "title" or not parts[1].isdigit():
+            app.count("not_found")
+            self.send_body(404, "<html><body>Not Found</body></html>", "text/html; charset=utf-8")
+            return
+        name, html = app.fixtures[int(parts[1]) % len(app.fixtures)]
+        etag = f'"{name}"'
+        if self.headers.get("If-None-Match") == etag:
+            app.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        app.count("pages")
+        self.send_body(200, html, "text/html; charset=utf-8", headers={"ETag": etag})
+
+
+class _Server:
+    """ThreadingHTTPServerをバックグラウンドで動かし、リクエスト数などを集計する"""
+
+    handler_class = None
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, rate_429=0.0, retry_after=1.0, seed=0):
+        self.latency_ms = latency_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._httpd = ThreadingHTTPServer((host, port), self.handler_class)
+        self._httpd.daemon_threads = True
+        self._httpd.app = self
+        self._thread = None
+        self.host = host
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._httpd.server_address[1]}"
+
+    def count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def wait_latency(self):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+    def should_throttle(self):
+        with self._stats_lock:
+            return self.rate_429 > 0 and self._random.random() < self.rate_429
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class FakeNotionServer(_Server):
+    """Notion APIの代替サーバー"""
+
+    handler_class = _NotionHandler
+
+    def __init__(self, database, **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+
+    @property
+    def api_base(self):
+        return f"{self.base_url}/v1"
+
+
+class CmoaFixtureServer(_Server):
+    """コミックシーモアの作品ページのフィクスチャを返すサーバー"""
+
+    handler_class = _CmoaHandler
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, **kwargs):
+        # Notionの代替サーバーと別のホスト名にして、main.py のレート制限を分ける
+        kwargs.setdefault("host", "localhost")
+        super().__init__(**kwargs)
+        self.fixtures = []
+        for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.html"))):
+            with open(path, encoding="utf-8") as f:
+                self.fixtures.append((os.path.basename(path), f.read()))
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--target-ratio", type=float, default=0.05)
+    parser.add_argument("--notion-latency-ms", type=float, default=0.0)
+    parser.add_argument("--cmoa-latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    args = parser.parse_args()
+
+    cmoa = CmoaFixtureServer(latency_ms=args.cmoa_latency_ms).start()
+    database = FakeNotionDatabase(args.rows, args.target_ratio, cmoa.base_url)
+    notion = FakeNotionServer(database, latency_ms=args.notion_latency_ms, rate_429=args.rate_429).start()
+    print("以下の環境変数で main.py を実行してください:")
+    print(f"  NOTION_API_KEY=bench DATABASE_ID={DATABASE_ID} NOTION_API_BASE={notion.api_base}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"Notion: {notion.stats}")
+        print(f"cmoa: {cmoa.stats}")
+    finally:
+        notion.stop()
+        cmoa.stop()
+
+
+if __name__ == "__main__":
+    run()
@@ -1,428 +1,2765 @@
+import time
+
+# 起動から最初のクエリまでの時間を計測するため、他のモジュールより先に時刻を記録する
+PROCESS_STARTED = time.monotonic()
+
 import os
+import re
+import importlib.util
+import hashlib
 import requests
 import json
-import time
 import sys
 import io
-from bs4 import BeautifulSoup
-from notion_client import Client
+import threading
+import queue
+import random
+import argparse
+import itertools
+import math
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+import sqlite3
+from requests.adapters import HTTPAdapter
+from collections import namedtuple
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 
 # 文字エンコーディングの問題を解決
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+# ワーカースレッドとページ取得が同時に出力しても行が壊れないよう、printを排他制御する
+_print_lock = threading.Lock()
+_builtin_print = print
+
+def print(*args, **kwargs):
+    with _print_lock:
+        _builtin_print(*args, **kwargs)
+
 # --- 設定項目 (GitHub Secretsから読み込む) ---
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 DATABASE_ID = os.getenv("DATABASE_ID")
 
-# Notionクライアントの初期化
-try:
-    notion = Client(auth=NOTION_API_KEY)
-    print("Notionクライアントの初期化が完了しました。")
-    
-    # 利用可能なメソッドを確認
-    print(f"利用可能なdatabasesメソッド: {[method for method in dir(notion.databases) if not method.startswith('_')]}")
-    print(f"利用可能なpagesメソッド: {[method for method in dir(notion.pages) if not method.startswith('_')]}")
-    
-    # Notion APIクライアントのバージョン情報を表示
+# --- 複数データベースの設定 ---
+# 複数のデータベースを1つのプロセスで同期するための設定ファイル（JSON。形式は load_database_configs を参照）
+# 空にすると NOTION_API_KEY と DATABASE_ID のデータベースだけを同期する
+SYNC_CONFIG_PATH = os.getenv("SYNC_CONFIG_PATH", "")
+
+# --- 並列処理・レート制限の設定 ---
+# SYNC_CONCURRENCY=1, CMOA_RATE_PER_SEC=0.33 とすると従来の逐次処理（1件ごとに3秒待機）とほぼ同じ動作になる
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", "4"))  # 同時に処理するページ数
+CMOA_RATE_PER_SEC = float(os.getenv("CMOA_RATE_PER_SEC", "1.0"))  # cmoa.jp への秒間リクエスト数
+NOTION_RATE_PER_SEC = float(os.getenv("NOTION_RATE_PER_SEC", "3.0"))  # Notion API への秒間リクエスト数（上限は約3回/秒）
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "10"))  # 取得済みで処理待ちのページを溜めておく上限
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(max(4, SYNC_CONCURRENCY))))  # ホストごとに保持するKeep-Alive接続の上限
+
+# --- Notion APIの設定 ---
+NOTION_API_BASE = os.getenv("NOTION_API_BASE", "https://api.notion.com/v1")  # ベンチマークではローカルの代替サーバーを指定する
+NOTION_VERSION = "2025-09-03"
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))  # 429・5xx・通信エラー時に再試行する回数
+NOTION_BACKOFF_BASE = float(os.getenv("NOTION_BACKOFF_BASE", "1.0"))  # 再試行の待機時間の基準（秒）。試行ごとに倍になる
+NOTION_BACKOFF_MAX = float(os.getenv("NOTION_BACKOFF_MAX", "30.0"))  # 再試行の待機時間の上限（秒）
+
+# --- 更新に失敗したページの再試行キュー ---
+RETRY_QUEUE_PATH = os.getenv("RETRY_QUEUE_PATH", ".cache/notion_retry_queue.json")  # 空にすると使わない
+RETRY_QUEUE_MAX_ATTEMPTS = int(os.getenv("RETRY_QUEUE_MAX_ATTEMPTS", "5"))  # この回数の実行で失敗し続けたら諦める
+
+# --- スクレイピング結果キャッシュの設定 ---
+SCRAPE_CACHE_PATH = os.getenv("SCRAPE_CACHE_PATH", ".cache/scrape_cache.sqlite3")  # 空にするとキャッシュを使わない
+SCRAPE_CACHE_TTL = int(os.getenv("SCRAPE_CACHE_TTL", str(24 * 60 * 60)))  # 秒。期限切れのエントリは条件付きリクエストで再検証する
+SCRAPE_CACHE_MAX_ENTRIES = int(os.getenv("SCRAPE_CACHE_MAX_ENTRIES", "10000"))  # 超えた分は最後に使われた日時が古い順に削除する
+
+# --- 取得に失敗し続けるURL・ドメインの障害への対策 ---
+# あらすじを取得できなかったURL（404・掲載終了・ページ構造の変更など）は、失敗記録をもとに間隔を空けて再試行する
+SCRAPE_FAILURE_BACKOFF_BASE = float(os.getenv("SCRAPE_FAILURE_BACKOFF_BASE", str(6 * 60 * 60)))  # 初回の失敗から再試行までの時間（秒）。失敗するたびに倍になる
+SCRAPE_FAILURE_BACKOFF_MAX = float(os.getenv("SCRAPE_FAILURE_BACKOFF_MAX", str(14 * 24 * 60 * 60)))  # 再試行までの時間の上限（秒）
+SCRAPE_FAILURE_POISON_AFTER = int(os.getenv("SCRAPE_FAILURE_POISON_AFTER", "6"))  # この回数失敗したURLは取得しない（0で無効）。URLを変更するか --reset-scrape-failures で記録はリセットされる
+# 5xx・429・通信エラーが同じURLで続く場合（リンク切れのホストなど）は、除外はせずに間隔を空けて再試行する
+SCRAPE_TRANSIENT_BACKOFF_AFTER = int(os.getenv("SCRAPE_TRANSIENT_BACKOFF_AFTER", "2"))  # 続けてこの回数失敗したら再試行待ちにし、同期状態の更新を止めない
+SCRAPE_TRANSIENT_BACKOFF_BASE = float(os.getenv("SCRAPE_TRANSIENT_BACKOFF_BASE", str(60 * 60)))  # 再試行待ちにしてから再試行までの時間（秒）。失敗するたびに倍になる
+SCRAPE_TRANSIENT_BACKOFF_MAX = float(os.getenv("SCRAPE_TRANSIENT_BACKOFF_MAX", str(24 * 60 * 60)))  # 再試行までの時間の上限（秒）
+# 5xx・429・通信エラーが続くドメインには、一定時間リクエストを送らない（サーキットブレーカー）
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # 連続してこの回数失敗したらリクエストを止める
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "60"))  # リクエストを止める時間（秒）。再開後の最初のリクエストも失敗すると倍になる
+CIRCUIT_COOLDOWN_MAX = float(os.getenv("CIRCUIT_COOLDOWN_MAX", "900"))  # リクエストを止める時間の上限（秒）
+
+# --- 取得件数の上限 ---
+MAX_QUERY_PAGES = int(os.getenv("MAX_QUERY_PAGES", "50"))  # 1回の実行でクエリするページ数の上限（1ページ100件）
+MAX_TARGET_PAGES = int(os.getenv("MAX_TARGET_PAGES", "100"))  # この件数の対象ページを見つけたら取得を停止する
+
+# --- 差分同期の設定 ---
+SYNC_STATE_PATH = os.getenv("SYNC_STATE_PATH", ".cache/sync_state.json")  # 空にすると毎回全件をチェックする
+FULL_SCAN_INTERVAL_HOURS = float(os.getenv("FULL_SCAN_INTERVAL_HOURS", "24"))  # この間隔で全件チェックを行う（0で定期的な全件チェックをしない）
+WATERMARK_OVERLAP_SECONDS = int(os.getenv("WATERMARK_OVERLAP_SECONDS", "300"))  # last_edited_timeは分単位のため、前回実行時刻より少し前から取得する
+
+# --- スキーマキャッシュの設定 ---
+# データベースIDから解決したデータソースIDとプロパティ情報を保存し、起動のたびに取得し直さないようにする
+SCHEMA_CACHE_PATH = os.getenv("SCHEMA_CACHE_PATH", ".cache/notion_schema.json")  # 空にすると毎回取得する
+
+# --- 常駐モード（python main.py serve）の設定 ---
+SERVE_POLL_INTERVAL = float(os.getenv("SERVE_POLL_INTERVAL", "30"))  # データソースの差分を取得する間隔（秒）
+SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")  # ヘルスチェック・Webhookを受け付けるアドレス
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8080"))  # ヘルスチェック・Webhookを受け付けるポート
+SERVE_UNHEALTHY_AFTER = float(os.getenv("SERVE_UNHEALTHY_AFTER", str(max(300.0, SERVE_POLL_INTERVAL * 5))))  # この秒数ポーリングに成功していなければ異常とする
+SERVE_SHUTDOWN_TIMEOUT = float(os.getenv("SERVE_SHUTDOWN_TIMEOUT", "30"))  # 終了時に処理中のページを待つ時間（秒）
+SERVE_RETRY_DELAY = float(os.getenv("SERVE_RETRY_DELAY", "60"))  # 処理に失敗したページをキューに戻すまでの時間（秒）。失敗するたびに倍になる
+SERVE_RETRY_QUEUE_INTERVAL = float(os.getenv("SERVE_RETRY_QUEUE_INTERVAL", "600"))  # 再試行キュー（Notionへの書き込みに失敗したページ）を処理する間隔（秒）
+SERVE_RETRY_MAX_ATTEMPTS = int(os.getenv("SERVE_RETRY_MAX_ATTEMPTS", "6"))  # この回数失敗したページは次の全件チェックまで処理しない
+
+# 常駐モードのキューの優先度（小さいほど先に処理する）
+SERVE_PRIORITY_WEBHOOK = 0  # Webhookで指定されたページ
+SERVE_PRIORITY_POLL = 1  # 差分取得で見つかったページ（新しく追加・編集されたページ）
+SERVE_PRIORITY_FULL_SCAN = 2  # 全件チェックで見つかったページ
+
+# --- 一括処理（python main.py backfill）の設定 ---
+# データソースをIDの範囲（IDプロパティがなければ作成日時の期間）で分割し、並行して全件を処理する
+BACKFILL_PARTITIONS = int(os.getenv("BACKFILL_PARTITIONS", "4"))  # 分割数（並行して取得するパーティションの数）
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", ".cache/backfill_checkpoint.json")  # 進捗の保存先。中断しても続きから再開する
+BACKFILL_PROGRESS_INTERVAL = float(os.getenv("BACKFILL_PROGRESS_INTERVAL", "30"))  # 進捗を表示・保存する間隔（秒）
+
+# --- 計測・実行レポートの設定 ---
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH", ".cache/run_report.json")  # 実行ごとのステージ別の計測結果（JSON）。空にすると出力しない
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")  # node_exporter の textfile collector 向けの出力先。空にすると出力しない
+PROFILE_PATH = ".cache/profile.prof"  # --profile でファイル名を省略したときの出力先
+
+# --- HTML解析の設定 ---
+# strained: 必要な要素だけを html.parser で解析する
+# html.parser / lxml: ページ全体を解析する（従来の方法 / lxmlがインストールされている場合）
+CMOA_PARSER = os.getenv("CMOA_PARSER", "strained")
+
+# --- クエリの設定 ---
+# 0にすると従来どおり全件を取得してクライアント側だけで絞り込む（転送量の比較用）
+NOTION_SERVER_FILTER = os.getenv("NOTION_SERVER_FILTER", "1") != "0"
+
+# データベースごとに名前を変えられるプロパティ（設定ファイルの properties で 既定の名前 -> 実際の名前 を指定する）
+MAPPED_PROPERTIES = ["URL", "タイトル", "あらすじ", "ジャンル", "雑誌・レーベル", "タグ", "ID"]
+
+# 更新対象のプロパティ（変更がなければ書き込みを省略するため、現在の値も取得する）
+WRITE_PROPERTIES = ["あらすじ", "ジャンル", "雑誌・レーベル", "タグ"]
+
+# クエリ結果に含めるプロパティ（処理に必要なものだけを取得する）
+PROJECTED_PROPERTIES = ["URL", "タイトル"] + WRITE_PROPERTIES
+
+# クエリ結果のページから処理に必要な値だけを取り出した軽量なレコード
+# current_values は更新対象プロパティの現在の値（simplify_property_valueの形式）
+# database はページが属するデータベースの DatabaseConfig
+PageRecord = namedtuple("PageRecord", ["page_id", "url", "title", "has_synopsis", "current_values", "database"],
+                        defaults=(None, None))
+
+# 同期するデータベース（name は表示・レポート用の名前、property_names は既定のプロパティ名 -> 実際のプロパティ名）
+DatabaseConfig = namedtuple("DatabaseConfig", ["name", "database_id", "api_key", "property_names"])
+
+# ステージごとのレイテンシを集計するヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 分位数（p50・p95）の計算のためにステージごとに保持するサンプル数の上限
+METRICS_SAMPLE_SIZE = 2048
+
+def percentile(sorted_values, p):
+    """昇順に並んだ値の分位数を返す（値がなければNone）"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p * len(sorted_values)) - 1)]
+
+class Metrics:
+    """ステージごとのレイテンシとイベントの回数を集計する"""
+
+    def __init__(self):
+        self.counters = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+
+    def increment(self, name, amount=1):
+        """カウンタを増やす"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage, seconds):
+        """ステージの処理時間を1回分記録する"""
+        with self._lock:
+            data = self.stages.get(stage)
+            if data is None:
+                data = self.stages[stage] = {
+                    "count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(LATENCY_BUCKETS), "samples": []
+                }
+            data["count"] += 1
+            data["sum"] += seconds
+            data["max"] = max(data["max"], seconds)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    data["buckets"][i] += 1
+                    break
+            # 件数が多くてもメモリが増えないよう、サンプルは一定数まで無作為に残す（リザーバーサンプリング）
+            if len(data["samples"]) < METRICS_SAMPLE_SIZE:
+                data["samples"].append(seconds)
+            else:
+                j = self._random.randrange(data["count"])
+                if j < METRICS_SAMPLE_SIZE:
+                    data["samples"][j] = seconds
+
+    @contextmanager
+    def timer(self, stage):
+        """with ブロックの処理時間をステージの処理時間として記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def snapshot(self):
+        """集計結果をJSONに変換できる形で返す"""
+        with self._lock:
+            stages = {}
+            for stage, data in sorted(self.stages.items()):
+                samples = sorted(data["samples"])
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(LATENCY_BUCKETS, data["buckets"]):
+                    cumulative += count
+                    buckets[f"{bound:g}"] = cumulative
+                buckets["+Inf"] = data["count"]
+                stages[stage] = {
+                    "count": data["count"],
+                    "total_seconds": round(data["sum"], 6),
+                    "mean_ms": round(data["sum"] / data["count"] * 1000, 3),
+                    "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+                    "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+                    "max_ms": round(data["max"] * 1000, 3),
+                    "buckets": buckets,
+                }
+            return {"stages": stages, "counters": dict(sorted(self.counters.items()))}
+
+# 実行中の計測結果（実行レポートとして出力する）
+metrics = Metrics()
+
+def notion_stage_name(method, path):
+    """Notion APIのリクエストを計測用のステージ名に分類する"""
+    parts = [part for part in path.split("?")[0].split("/") if part]
+    if parts[:1] == ["databases"]:
+        return "notion.retrieve_database"
+    if parts[:1] == ["data_sources"]:
+        return "notion.query" if parts[-1] == "query" else "notion.retrieve_data_source"
+    if parts[:1] == ["pages"]:
+        return "notion.update" if method == "PATCH" else "notion.retrieve_page"
+    return "notion.other"
+
+class TokenBucket:
+    """ホストごとのリクエスト頻度を制限するトークンバケット"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得できるまで待機する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Retry-After などで指定された時間、全スレッドのリクエストを止める"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+# ホストごとのレートリミッター（未知のホストは cmoa.jp と同じレートで作成する）
+rate_limiters = {
+    "cmoa.jp": TokenBucket(CMOA_RATE_PER_SEC),
+}
+# Notion APIのレート制限はインテグレーション（APIトークン）ごとのため、トークンごとに持つ
+notion_rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+def domain_key(url):
+    """レート制限・サーキットブレーカーの単位となるドメインを返す（cmoa.jpのサブドメインはまとめる）"""
+    host = urlparse(url).hostname or ""
+    if host == "cmoa.jp" or host.endswith(".cmoa.jp"):
+        return "cmoa.jp"
+    return host
+
+def get_rate_limiter(url):
+    """URLのホストに対応するレートリミッターを返す"""
+    host = domain_key(url)
+    with rate_limiters_lock:
+        bucket = rate_limiters.get(host)
+        if bucket is None:
+            bucket = rate_limiters[host] = TokenBucket(CMOA_RATE_PER_SEC)
+    return bucket
+
+def get_notion_rate_limiter(api_key):
+    """APIトークンに対応するレートリミッターを返す（同じトークンを使うデータベースで共有する）"""
+    with rate_limiters_lock:
+        bucket = notion_rate_limiters.get(api_key)
+        if bucket is None:
+            bucket = notion_rate_limiters[api_key] = TokenBucket(NOTION_RATE_PER_SEC)
+    return bucket
+
+class CircuitBreaker:
+    """ドメインごとのサーキットブレーカー（5xx・429・通信エラーが続いたら一定時間リクエストを止める）"""
+
+    def __init__(self, failure_threshold, cooldown, cooldown_max):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self.state = "closed"
+        self.opened_count = 0
+        self._failures = 0
+        self._current_cooldown = cooldown
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """リクエストを送ってよいかを返す（停止時間が過ぎたら、様子見のリクエストを1回だけ許可する）"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if now < self._open_until:
+                return False
+            # 様子見のリクエストが結果を返さなかった場合に備えて、次の様子見までは停止時間を空ける
+            self.state = "half_open"
+            self._open_until = now + self._current_cooldown
+            return True
+
+    def retry_in(self):
+        """リクエストを再開できるまでの秒数を返す"""
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            return max(0, self._open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._current_cooldown = self.cooldown
+
+    def record_failure(self):
+        """失敗を記録する。停止した場合はTrueを返す"""
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open":
+                # 再開後の様子見も失敗したので、停止時間を延ばす
+                self._current_cooldown = min(self.cooldown_max, self._current_cooldown * 2)
+            elif self.state == "open" or self._failures < max(1, self.failure_threshold):
+                return False
+            self.state = "open"
+            self.opened_count += 1
+            self._open_until = time.monotonic() + self._current_cooldown
+            return True
+
+# ドメインごとのサーキットブレーカー（cmoa.jpなどスクレイピング先に使う）
+circuit_breakers = {}
+
+def get_circuit_breaker(url):
+    """URLのドメインに対応するサーキットブレーカーを返す"""
+    host = domain_key(url)
+    with rate_limiters_lock:
+        breaker = circuit_breakers.get(host)
+        if breaker is None:
+            breaker = circuit_breakers[host] = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN, CIRCUIT_COOLDOWN_MAX)
+    return breaker
+
+def circuit_breaker_stats():
+    """ドメインごとのサーキットブレーカーの状態を返す"""
+    with rate_limiters_lock:
+        breakers = list(circuit_breakers.items())
+    return {host: {"state": breaker.state, "opened": breaker.opened_count} for host, breaker in breakers}
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため、リクエストを送らなかったことを表す"""
+
+class ScrapeTemporaryError(Exception):
+    """5xx・429・通信エラーなど、時間を空ければ成功する可能性がある取得の失敗を表す
+
+    backing_off は、同じURLで失敗が続いたため失敗記録により再試行待ちにしたかどうか
+    """
+
+    def __init__(self, message, backing_off=False):
+        super().__init__(message)
+        self.backing_off = backing_off
+
+# ホストごとに使い回すHTTPセッション（同じホストへの接続はKeep-Aliveで再利用する）
+http_sessions = {}
+http_sessions_lock = threading.Lock()
+
+def get_http_session(host):
+    """ホストに対応するHTTPセッションを返す（なければ作成する）"""
+    with http_sessions_lock:
+        session = http_sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+            http_sessions[host] = session
+    return session
+
+def http_request(method, url, rate_limiter=None, stage=None, **kwargs):
+    """レート制限を守りつつ、ホストごとのセッションでリクエストを送る（rate_limiter を省略するとホストのレート制限）
+
+    レート制限による待ち時間は ratelimit.wait.<ドメイン> に記録し、stage を指定すると
+    待ち時間を除いたリクエスト自体の所要時間をそのステージに記録する
+    """
+    with metrics.timer(f"ratelimit.wait.{domain_key(url)}"):
+        (rate_limiter or get_rate_limiter(url)).acquire()
+    session = get_http_session(urlparse(url).hostname or "")
+    if stage is None:
+        return session.request(method, url, **kwargs)
+    with metrics.timer(stage):
+        return session.request(method, url, **kwargs)
+
+# Notion APIの呼び出し・書き込みの集計
+notion_stats = {"retries": 0, "updated": 0, "unchanged": 0, "queued": 0}
+notion_stats_lock = threading.Lock()
+
+def count_notion_stat(name):
+    with notion_stats_lock:
+        notion_stats[name] += 1
+
+def backoff_delay(attempt):
+    """指数バックオフ（ジッター付き）の待機時間を返す"""
+    delay = min(NOTION_BACKOFF_MAX, NOTION_BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def retry_after_seconds(response):
+    """Retry-Afterヘッダーの秒数を返す（ない場合はNone）"""
     try:
-        import notion_client
-        print(f"Notion APIクライアントバージョン: {notion_client.__version__}")
-    except:
-        print("Notion APIクライアントのバージョン情報を取得できませんでした")
-    
-except Exception as e:
-    print(f"Notionクライアントの初期化に失敗しました: {e}")
-    exit(1)
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+def notion_request(database, method, path, **kwargs):
+    """データベースのAPIトークンでNotion REST APIにリクエストを送る（429・5xx・通信エラーは待機して再試行する）
+
+    ステージには1回ごとのリクエストの所要時間を記録する。レート制限による待ち時間は ratelimit.wait.<ドメイン> に、
+    5xx・通信エラー後の再試行までの待ち時間は notion.backoff に分けて記録する
+    """
+    stage = notion_stage_name(method, path)
+    headers = {
+        'Authorization': f'Bearer {database.api_key}',
+        'Notion-Version': NOTION_VERSION,
+        'Content-Type': 'application/json'
+    }
+    url = f"{NOTION_API_BASE}{path}"
+    rate_limiter = get_notion_rate_limiter(database.api_key)
+    attempt = 0
+    while True:
+        try:
+            response = http_request(method, url, rate_limiter=rate_limiter, stage=stage, headers=headers, timeout=30, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            metrics.increment("notion.connection_errors")
+            if attempt >= NOTION_MAX_RETRIES:
+                raise
+            with metrics.timer("notion.backoff"):
+                time.sleep(backoff_delay(attempt))
+        else:
+            metrics.increment(f"notion.status.{response.status_code}")
+            if response.status_code != 429 and response.status_code < 500:
+                return response
+            if attempt >= NOTION_MAX_RETRIES:
+                return response
+            if response.status_code == 429:
+                # レート制限を超えたので、指定された時間は同じトークンを使う全スレッドのリクエストを止める
+                rate_limiter.pause(retry_after_seconds(response) or backoff_delay(attempt))
+            else:
+                with metrics.timer("notion.backoff"):
+                    time.sleep(backoff_delay(attempt))
+        attempt += 1
+        count_notion_stat("retries")
+
+def simplify_property_value(prop):
+    """プロパティの値を比較しやすい形（文字列または名前のタプル）に変換する"""
+    if "rich_text" in prop or "title" in prop:
+        texts = prop.get("rich_text", prop.get("title")) or []
+        return "".join(t.get("plain_text", t.get("text", {}).get("content", "")) for t in texts)
+    if "multi_select" in prop:
+        return tuple(sorted(option.get("name", "") for option in prop.get("multi_select") or []))
+    return None
+
+NOTION_TEXT_MAX_LENGTH = 2000  # Notion APIのテキストオブジェクト1つに入れられる文字数の上限
+
+def rich_text_chunks(text):
+    """上限の文字数ごとにテキストオブジェクトへ分割する"""
+    return [
+        {"text": {"content": text[start:start + NOTION_TEXT_MAX_LENGTH]}}
+        for start in range(0, len(text), NOTION_TEXT_MAX_LENGTH)
+    ]
+
+def multi_select_options(names):
+    """マルチセレクトの選択肢を作成する（Notionは選択肢の名前にカンマを使えないため全角に置き換える）"""
+    return [{"name": name.replace(",", "，")} for name in names if name]
+
+def build_properties_to_update(cmoa_data, database):
+    """スクレイピング結果から、Notionに書き込むプロパティ（データベースでのプロパティ名）を作成する"""
+    return {
+        property_name(database, "あらすじ"): {"rich_text": rich_text_chunks(cmoa_data["synopsis"])},
+        property_name(database, "ジャンル"): {"multi_select": multi_select_options(cmoa_data["genres"])},
+        property_name(database, "雑誌・レーベル"): {"multi_select": multi_select_options([cmoa_data["magazine"]])},
+        property_name(database, "タグ"): {"multi_select": multi_select_options(cmoa_data["tags"])}
+    }
+
+def diff_properties(current_values, properties_to_update):
+    """現在の値と異なるプロパティだけを返す（現在の値が不明なら全て返す）"""
+    if current_values is None:
+        return dict(properties_to_update)
+    return {
+        name: prop for name, prop in properties_to_update.items()
+        if name not in current_values or current_values[name] != simplify_property_value(prop)
+    }
+
+def update_notion_page(database, page_id, properties_to_update, current_values=None):
+    """ページを更新する。("updated" | "unchanged" | "retry" | "rejected" | "failed", メッセージ) を返す
+
+    "rejected" は書き込む内容やページ自体が原因で、再試行しても成功しない失敗（400・404）を表す
+    """
+    changes = diff_properties(current_values, properties_to_update)
+    if not changes:
+        count_notion_stat("unchanged")
+        return "unchanged", "変更がないため更新を省略しました。"
+    try:
+        response = notion_request(database, "PATCH", f"/pages/{page_id}", json={"properties": changes})
+    except requests.exceptions.RequestException as e:
+        return "retry", str(e)
+    if response.status_code == 200:
+        count_notion_stat("updated")
+        return "updated", f"{len(changes)}個のプロパティを更新しました。"
+    if response.status_code in (409, 429) or response.status_code >= 500:
+        status = "retry"
+    elif response.status_code in (400, 404):
+        status = "rejected"
+    else:
+        # 401・403はAPIトークンや権限の問題で、全てのページの更新に影響するため失敗として扱う
+        status = "failed"
+    return status, f"{response.status_code} - {response.text}"
+
+def write_file_atomic(path, text):
+    """ファイルを書き込む（途中で中断されても壊れないよう、一時ファイルに書いてから置き換える）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class RetryQueue:
+    """更新に失敗したページを次回の実行で再試行するための永続キュー（JSONファイル）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._items = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError as e:
+            print(f"再試行キューを読み込めなかったため、空のキューから始めます: {e}")
+            return []
+
+    def _save(self):
+        write_file_atomic(self.path, json.dumps(self._items, ensure_ascii=False))
+
+    def add(self, database_id, page_id, title, properties, attempts=0):
+        """ページを追加する（同じページがあれば置き換える）"""
+        with self._lock:
+            self._items = [item for item in self._items if item["page_id"] != page_id]
+            self._items.append({
+                "database_id": database_id, "page_id": page_id, "title": title,
+                "properties": properties, "attempts": attempts,
+            })
+            self._save()
+        count_notion_stat("queued")
+
+    def pop_database(self, database_id):
+        """データベースのページを全て取り出す（database_id のない以前の形式は DATABASE_ID のページとして扱う）"""
+        with self._lock:
+            items = [item for item in self._items if item.get("database_id", DATABASE_ID) == database_id]
+            if items:
+                self._items = [item for item in self._items if item.get("database_id", DATABASE_ID) != database_id]
+                self._save()
+        return items
+
+# main()の開始時に開く（RETRY_QUEUE_PATHが空の場合は使わない）
+retry_queue = None
+
+def drain_retry_queue(database):
+    """前回までの実行で更新に失敗したデータベースのページを再試行する"""
+    items = retry_queue.pop_database(database.database_id)
+    if not items:
+        return
+    print(f"前回更新に失敗したページを再試行します: {len(items)}件")
+    for item in items:
+        page_id, title = item["page_id"], item["title"]
+
+        # 現在の値を確認し、削除済み・既に入力済みのページは再試行しない
+        current_values = None
+        try:
+            response = notion_request(database, "GET", f"/pages/{page_id}")
+            if response.status_code == 404:
+                print(f"  {title}: ページが見つからないため再試行を取りやめます。")
+                continue
+            if response.status_code == 200:
+                page = response.json()
+                record = to_page_record(page, database)
+                if page.get("archived") or page.get("in_trash"):
+                    print(f"  {title}: ページが削除済みのため再試行を取りやめます。")
+                    continue
+                if record.has_synopsis:
+                    print(f"  {title}: あらすじが既に入力されているため再試行を取りやめます。")
+                    continue
+                current_values = record.current_values
+        except requests.exceptions.RequestException as e:
+            print(f"  {title}: ページ情報の取得に失敗しました: {e}")
+
+        status, message = update_notion_page(database, page_id, item["properties"], current_values)
+        if status in ("updated", "unchanged"):
+            print(f"  成功: {title} - {message}")
+        elif status == "retry" and item["attempts"] + 1 < RETRY_QUEUE_MAX_ATTEMPTS:
+            print(f"  再度失敗したため、次回に再試行します: {title} - {message}")
+            retry_queue.add(database.database_id, page_id, title, item["properties"], item["attempts"] + 1)
+        else:
+            print(f"  更新を諦めました: {title} - {message}")
+
+def connection_stats():
+    """ホストごとのリクエスト数と新規接続数を集計する"""
+    stats = {}
+    with http_sessions_lock:
+        sessions = list(http_sessions.items())
+    for host, session in sessions:
+        pools = session.get_adapter("https://").poolmanager.pools
+        requests_sent = 0
+        connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        stats[host] = {"requests": requests_sent, "connections": connections}
+    return stats
+
+# URLの正規化で取り除くトラッキング用のクエリパラメータ
+TRACKING_QUERY_PARAMS = {"fbclid", "gclid", "yclid", "msclkid", "_ga", "ref"}
+
+def normalize_url(url):
+    """キャッシュのキーとして使うため、URLを正規化する"""
+    parsed = urlparse(url.strip())
+    query = [
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in TRACKING_QUERY_PARAMS and not key.startswith("utm_")
+    ]
+    return urlunparse((
+        parsed.scheme.lower(),
+        parsed.netloc.lower(),
+        parsed.path or "/",
+        "",
+        urlencode(sorted(query)),
+        ""
+    ))
+
+# コミックシーモアの作品ページのパス（/title/作品ID/）
+CMOA_TITLE_PATH_PATTERN = re.compile(r"^/title/(\d+)/?$")
+
+def scrape_dedup_key(url):
+    """同じ作品のURLをまとめるためのキー（cmoa.jpの作品ページは作品ID、それ以外は正規化したURL）"""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    match = CMOA_TITLE_PATH_PATTERN.match(parsed.path)
+    if match and (host == "cmoa.jp" or host.endswith(".cmoa.jp")):
+        return f"cmoa:title:{match.group(1)}"
+    return normalize_url(url)
+
+CachedScrape = namedtuple("CachedScrape", ["data", "etag", "last_modified", "is_fresh"])
+ScrapeFailure = namedtuple("ScrapeFailure", ["failures", "last_error", "next_retry_at", "poisoned"])
+TransientFailure = namedtuple("TransientFailure", ["failures", "last_error", "next_retry_at"])
+
+class ScrapeCache:
+    """スクレイピング結果を正規化したURLごとに保存するSQLiteキャッシュ
+
+    あらすじを取得できなかったURLの失敗記録（次に再試行する時刻）も同じデータベースに保存する。
+    5xx・429・通信エラーによる一時的な失敗は、除外の対象にしないよう別のテーブルで数える
+    """
+
+    def __init__(self, path, ttl, max_entries):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "stale": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scrape_cache ("
+            "url TEXT PRIMARY KEY, data TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scrape_cache_accessed_at ON scrape_cache (accessed_at)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scrape_failures ("
+            "url TEXT PRIMARY KEY, failures INTEGER NOT NULL, last_error TEXT, "
+            "last_failed_at REAL NOT NULL, next_retry_at REAL NOT NULL, poisoned INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scrape_transient_failures ("
+            "url TEXT PRIMARY KEY, failures INTEGER NOT NULL, last_error TEXT, "
+            "last_failed_at REAL NOT NULL, next_retry_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, url):
+        """キャッシュを検索する。エントリがなければNoneを返す"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, etag, last_modified, fetched_at FROM scrape_cache WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE scrape_cache SET accessed_at = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+            is_fresh = now - row[3] < self.ttl
+            self.stats["hits" if is_fresh else "stale"] += 1
+            return CachedScrape(json.loads(row[0]), row[1], row[2], is_fresh)
+
+    def mark_revalidated(self, url):
+        """304 Not Modified を受け取ったエントリの有効期限を延長する"""
+        now = time.time()
+        with self._lock:
+            self.stats["revalidated"] += 1
+            self._conn.execute("UPDATE scrape_cache SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self._conn.commit()
+
+    def put(self, url, data, etag=None, last_modified=None):
+        """スクレイピング結果を保存し、上限を超えた分を古い順に削除する"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scrape_cache (url, data, etag, last_modified, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, json.dumps(data, ensure_ascii=False), etag, last_modified, now, now)
+            )
+            cursor = self._conn.execute(
+                "DELETE FROM scrape_cache WHERE url IN ("
+                "SELECT url FROM scrape_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.stats["evictions"] += max(cursor.rowcount, 0)
+            self._conn.commit()
+
+    def get_failure(self, url):
+        """URLの失敗記録を返す（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT failures, last_error, next_retry_at, poisoned FROM scrape_failures WHERE url = ?", (url,)
+            ).fetchone()
+        return ScrapeFailure(row[0], row[1], row[2], bool(row[3])) if row else None
+
+    def record_failure(self, url, error):
+        """失敗を記録し、次に再試行する時刻を失敗回数に応じて延ばす"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT failures FROM scrape_failures WHERE url = ?", (url,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            delay = min(SCRAPE_FAILURE_BACKOFF_MAX, SCRAPE_FAILURE_BACKOFF_BASE * (2 ** (failures - 1)))
+            poisoned = 0 < SCRAPE_FAILURE_POISON_AFTER <= failures
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scrape_failures (url, failures, last_error, last_failed_at, next_retry_at, poisoned) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, failures, error, now, now + delay, int(poisoned))
+            )
+            self._conn.commit()
+        return ScrapeFailure(failures, error, now + delay, poisoned)
+
+    def get_transient_failure(self, url):
+        """URLの一時的な失敗の記録を返す（なければNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT failures, last_error, next_retry_at FROM scrape_transient_failures WHERE url = ?", (url,)
+            ).fetchone()
+        return TransientFailure(*row) if row else None
+
+    def record_transient_failure(self, url, error):
+        """一時的な失敗を記録し、続けて SCRAPE_TRANSIENT_BACKOFF_AFTER 回失敗していれば再試行までの時間を延ばす"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT failures FROM scrape_transient_failures WHERE url = ?", (url,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            over = failures - SCRAPE_TRANSIENT_BACKOFF_AFTER
+            delay = min(SCRAPE_TRANSIENT_BACKOFF_MAX, SCRAPE_TRANSIENT_BACKOFF_BASE * (2 ** over)) if over >= 0 else 0
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scrape_transient_failures (url, failures, last_error, last_failed_at, next_retry_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, failures, error, now, now + delay)
+            )
+            self._conn.commit()
+        return TransientFailure(failures, error, now + delay)
+
+    def clear_failure(self, url):
+        """取得に成功したURLの失敗記録を削除する"""
+        with self._lock:
+            self._conn.execute("DELETE FROM scrape_failures WHERE url = ?", (url,))
+            self._conn.execute("DELETE FROM scrape_transient_failures WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def reset_failures(self):
+        """すべての失敗記録を削除し、削除した件数を返す"""
+        with self._lock:
+            count = sum(
+                max(self._conn.execute(f"DELETE FROM {table}").rowcount, 0)
+                for table in ("scrape_failures", "scrape_transient_failures")
+            )
+            self._conn.commit()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# main()の開始時に開く（SCRAPE_CACHE_PATHが空の場合は使わない）
+scrape_cache = None
+
+def scrape_failure_status(url):
+    """失敗記録により取得を見送るURLなら理由（"backoff": 再試行待ち | "poisoned": 除外）を返す"""
+    if not scrape_cache:
+        return None
+    cache_key = normalize_url(url)
+    failure = scrape_cache.get_failure(cache_key)
+    if failure and failure.poisoned:
+        return "poisoned"
+    transient = scrape_cache.get_transient_failure(cache_key)
+    next_retry_at = max(failure.next_retry_at if failure else 0, transient.next_retry_at if transient else 0)
+    return "backoff" if next_retry_at > time.time() else None
+
+def reset_scrape_failures():
+    """失敗記録をすべて削除する（解析処理を直した後などに、除外したURLを取得し直すため）"""
+    if not SCRAPE_CACHE_PATH:
+        print("スクレイピングキャッシュを使わない設定のため、失敗記録はありません。")
+        return
+    try:
+        cache = ScrapeCache(SCRAPE_CACHE_PATH, SCRAPE_CACHE_TTL, SCRAPE_CACHE_MAX_ENTRIES)
+    except sqlite3.Error as cache_error:
+        print(f"スクレイピングキャッシュを開けなかったため、失敗記録を削除できませんでした: {cache_error}")
+        return
+    try:
+        count = cache.reset_failures()
+    finally:
+        cache.close()
+    print(f"スクレイピングの失敗記録を削除しました: {count}件")
+
+def record_scrape_failure(cache_key, error):
+    """あらすじを取得できなかったURLを失敗記録に追加する"""
+    metrics.increment("cmoa.failures_recorded")
+    if not scrape_cache:
+        return
+    failure = scrape_cache.record_failure(cache_key, error)
+    if failure.poisoned:
+        print(f"{failure.failures}回続けて取得できなかったため、今後は取得しません: {cache_key}")
+
+def record_scrape_transient_failure(cache_key, error):
+    """5xx・429・通信エラーで取得できなかったURLを記録し、再試行待ちにしたかどうかを返す"""
+    metrics.increment("cmoa.transient_failures_recorded")
+    if not scrape_cache:
+        return False
+    failure = scrape_cache.record_transient_failure(cache_key, error)
+    if failure.failures < SCRAPE_TRANSIENT_BACKOFF_AFTER:
+        return False
+    wait_hours = (failure.next_retry_at - time.time()) / 3600
+    print(f"{failure.failures}回続けて一時的な障害で取得できなかったため、{wait_hours:.1f}時間後まで再試行を待ちます: {cache_key}")
+    return True
 
 def scrape_cmoa_data(url):
-    """コミックシーモアのページからデータを取得する"""
+    """コミックシーモアのページからデータを取得する（キャッシュがあれば利用する）
+
+    ドメインのサーキットブレーカーが開いている場合は CircuitOpenError を、
+    5xx・429・通信エラーなどの一時的な障害の場合は ScrapeTemporaryError を送出する
+    """
     try:
-        exclusion_phrases = [
-            'コミックシーモアなら期間限定1巻無料！',
-            'コミックシーモアなら期間限定1巻立読み増量中！',
-            'コミックシーモアなら期間限定1巻値引き！'
-        ]
-        genre_rename_map = {
-            '少年マンガ': '少年',
-            '青年マンガ': '青年',
-            '少女マンガ': '少女',
-            '女性マンガ': '女性'
-        }
+        cache_key = normalize_url(url)
+        cached = scrape_cache.get(cache_key) if scrape_cache else None
+        if cached and cached.is_fresh:
+            return cached.data
 
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=15)
+        # 期限切れのエントリは条件付きリクエストで再検証する
+        if cached:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        breaker = get_circuit_breaker(url)
+        if not breaker.allow():
+            metrics.increment("cmoa.circuit_rejected")
+            raise CircuitOpenError(f"{domain_key(url)} へのリクエストを一時停止しています（あと{breaker.retry_in():.0f}秒）")
+        try:
+            response = http_request("GET", url, stage="cmoa.fetch", headers=headers, timeout=15)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if breaker.record_failure():
+                metrics.increment("cmoa.circuit_opened")
+                print(f"{domain_key(url)} への通信エラーが続いたため、リクエストを一時停止します。")
+            raise
+        metrics.increment(f"cmoa.status.{response.status_code}")
+
+        # 5xx・429は一時的な障害なので、URLの失敗としては記録せずサーキットブレーカーに記録する
+        if response.status_code == 429 or response.status_code >= 500:
+            if response.status_code == 429:
+                get_rate_limiter(url).pause(retry_after_seconds(response) or CIRCUIT_COOLDOWN)
+            if breaker.record_failure():
+                metrics.increment("cmoa.circuit_opened")
+                print(f"{domain_key(url)} から {response.status_code} が続いたため、リクエストを一時停止します。")
+            print(f"URLへのアクセスに失敗しました: {url}, Status: {response.status_code}")
+            error = f"HTTP {response.status_code}"
+            raise ScrapeTemporaryError(error, record_scrape_transient_failure(cache_key, error))
+        breaker.record_success()
+
+        if cached and response.status_code == 304:
+            # 内容が変わっていないので、解析せずにキャッシュの結果を返す
+            scrape_cache.mark_revalidated(cache_key)
+            return cached.data
+        if response.status_code >= 400:
+            record_scrape_failure(cache_key, f"HTTP {response.status_code}")
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
 
-        # 1. あらすじ取得
-        synopsis = ""
-        script_tag = soup.find("script", type="application/ld+json")
-        if script_tag:
-            try:
-                clean_string = script_tag.string.encode('utf-8').decode('utf-8')
-                json_data = json.loads(clean_string)
-                synopsis = json_data.get("description", "")
-            except Exception:
-                synopsis = ""
-
-        if not synopsis:
-            description_div = soup.select_one("div#comic_description p")
-            if description_div:
-                for br in description_div.find_all("br"):
-                    br.replace_with("\n")
-                synopsis = description_div.get_text()
-
-        synopsis = synopsis.replace("<br>", "\n")
-        for phrase in exclusion_phrases:
-            synopsis = synopsis.replace(phrase, "")
-        synopsis = synopsis.strip()
-
-        # 2. ジャンル取得
-        genres = []
-        genre_tags = soup.select('.category_line_f_r_l a[href*="/genre/"]')
-        for tag in genre_tags:
-            genre_text = tag.get_text(strip=True)
-            cleaned_genre = genre_text.split('(')[0].strip()
-            renamed_genre = genre_rename_map.get(cleaned_genre, cleaned_genre)
-            genres.append(renamed_genre)
-        
-        # 3. 雑誌・レーベル取得
-        magazine = ""
-        magazine_tag = soup.select_one('span.brCramb_m > a[href*="/magazine/"]')
-        if magazine_tag:
-            magazine = magazine_tag.get_text(strip=True)
+        with metrics.timer("cmoa.parse"):
+            cmoa_data = parse_cmoa_html(response.text)
+        if cmoa_data["synopsis"]:
+            if scrape_cache:
+                scrape_cache.put(cache_key, cmoa_data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                scrape_cache.clear_failure(cache_key)
         else:
-            publisher_tag = soup.select_one('.category_line a[href*="/publisher/"]')
-            if publisher_tag:
-                magazine = publisher_tag.get_text(strip=True)
-        
-        # 4. 作品タグ取得
-        tags = []
-        # === 変更点: ご提示のHTML構造に合わせた最終ロジック ===
-        # 「作品タグ」というテキストを持つdivを探す
-        tag_label_div = soup.find('div', class_='category_line_f_l_l', string='作品タグ')
-        if tag_label_div:
-            # その親をたどり、タグのリンクが入っているdivを探す
-            tag_container_div = tag_label_div.find_next_sibling('div', class_='category_line_f_r_l')
-            if tag_container_div:
-                # コンテナ内の全てのaタグ(リンク)を取得
-                tag_elements = tag_container_div.find_all('a')
-                for tag_element in tag_elements:
-                    tags.append(tag_element.get_text(strip=True))
-        # =======================================================
-
-        return {
-            "synopsis": synopsis,
-            "genres": list(dict.fromkeys(genres)),
-            "magazine": magazine,
-            "tags": list(dict.fromkeys(tags))
-        }
+            record_scrape_failure(cache_key, "あらすじなし")
+        return cmoa_data
+    except (CircuitOpenError, ScrapeTemporaryError):
+        raise
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        metrics.increment("cmoa.errors")
+        print(f"URLへのアクセスに失敗しました: {url}, Error: {e}")
+        error = type(e).__name__
+        raise ScrapeTemporaryError(error, record_scrape_transient_failure(normalize_url(url), error)) from e
     except requests.exceptions.RequestException as e:
+        # URLの形式が正しくないなど、再試行しても成功しないエラー
+        metrics.increment("cmoa.errors")
+        if not isinstance(e, requests.exceptions.HTTPError):
+            record_scrape_failure(normalize_url(url), type(e).__name__)
         print(f"URLへのアクセスに失敗しました: {url}, Error: {e}")
         return None
     except Exception as e:
+        record_scrape_failure(normalize_url(url), f"{type(e).__name__}: {e}")
         print(f"スクレイピング中にエラーが発生しました: {e}")
         return None
 
-def main():
-    """メイン処理"""
-    if not NOTION_API_KEY or not DATABASE_ID:
-        print("エラー: 環境変数 NOTION_API_KEY と DATABASE_ID が設定されていません。")
+class ScrapeDedup:
+    """1回の実行の中で同じ作品のURLを1回だけ取得し、結果を同じキーの全ページで共有する
+
+    インデックスはページを処理するたびに追加していくため、クエリの結果を順次処理する場合にも使える。
+    取得中の作品のページは、先に取得を始めたページの結果を待って受け取る
+    """
+
+    def __init__(self):
+        self.entries = {}  # キー -> {"done": 取得完了のEvent, "data": 取得結果, "error": 送出された例外}
+        self.stats = {"pages": 0, "fetched": 0, "shared": 0}
+        self._lock = threading.Lock()
+
+    def scrape(self, url):
+        """(取得結果, 他のページの結果を共有したかどうか) を返す"""
+        key = scrape_dedup_key(url)
+        with self._lock:
+            self.stats["pages"] += 1
+            entry = self.entries.get(key)
+            shared = entry is not None
+            if shared:
+                self.stats["shared"] += 1
+            else:
+                entry = self.entries[key] = {"done": threading.Event(), "data": None, "error": None}
+                self.stats["fetched"] += 1
+        if shared:
+            metrics.increment("cmoa.dedup_shared")
+            entry["done"].wait()
+            if entry["error"]:
+                raise entry["error"]
+            return entry["data"], True
+
+        try:
+            entry["data"] = scrape_cmoa_data(url)
+        except (CircuitOpenError, ScrapeTemporaryError) as e:
+            entry["error"] = e
+            # 延期・一時的に失敗した作品は、後から見つかったページで取得し直す
+            with self._lock:
+                self.entries.pop(key, None)
+            raise
+        finally:
+            entry["done"].set()
+        return entry["data"], False
+
+    def reset(self):
+        """インデックスを空にする（常駐モードでポーリングごとに取得し直すため）"""
+        with self._lock:
+            self.entries = {}
+
+    def report(self):
+        """実行レポート用の集計（ratio は結果を共有したページの割合）"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["ratio"] = round(stats["shared"] / stats["pages"], 3) if stats["pages"] else 0.0
+        return stats
+
+# main()の開始時に作成する
+scrape_dedup = None
+
+def cmoa_parser_available(parser):
+    """指定された解析方法が使えるかどうかを返す"""
+    if parser in ("strained", "html.parser"):
+        return True
+    return parser == "lxml" and importlib.util.find_spec("lxml") is not None
+
+def is_cmoa_target_tag(name, attrs):
+    """あらすじ・ジャンル・雑誌・タグの取得に必要な要素かどうかを判定する"""
+    attrs = attrs or {}
+    if name == "script":
+        return attrs.get("type") == "application/ld+json"
+    if name == "div" and attrs.get("id") == "comic_description":
+        return True
+    classes = (attrs.get("class") or "").split()
+    if name == "span" and "brCramb_m" in classes:
+        return True
+    return any(c.startswith("category_line") for c in classes)
+
+cmoa_parse_filter = None
+
+def get_cmoa_parse_filter():
+    """必要な要素だけを解析するためのフィルタを返す（bs4のバージョン差を吸収する）"""
+    global cmoa_parse_filter
+    if cmoa_parse_filter is None:
+        try:
+            from bs4.filter import ElementFilter
+        except ImportError:
+            # bs4 4.13より前は、SoupStrainerに渡した関数が(タグ名, 属性)で呼ばれる
+            from bs4 import SoupStrainer
+            cmoa_parse_filter = SoupStrainer(is_cmoa_target_tag)
+        else:
+            class CmoaElementFilter(ElementFilter):
+                def allow_tag_creation(self, nsprefix, name, attrs):
+                    return is_cmoa_target_tag(name, attrs)
+
+                def allow_string_creation(self, string):
+                    return False
+
+            cmoa_parse_filter = CmoaElementFilter()
+    return cmoa_parse_filter
+
+def parse_cmoa_html(html, parser=None):
+    """コミックシーモアのページのHTMLから、あらすじ・ジャンル・雑誌・タグを取り出す"""
+    exclusion_phrases = [
+        'コミックシーモアなら期間限定1巻無料！',
+        'コミックシーモアなら期間限定1巻立読み増量中！',
+        'コミックシーモアなら期間限定1巻値引き！'
+    ]
+    genre_rename_map = {
+        '少年マンガ': '少年',
+        '青年マンガ': '青年',
+        '少女マンガ': '少女',
+        '女性マンガ': '女性'
+    }
+
+    # bs4は読み込みに時間がかかるため、最初にHTMLを解析するときに読み込む
+    from bs4 import BeautifulSoup
+
+    parser = parser or CMOA_PARSER
+    if parser == "strained":
+        soup = BeautifulSoup(html, 'html.parser', parse_only=get_cmoa_parse_filter())
+    else:
+        soup = BeautifulSoup(html, parser)
+    script_tag = soup.find("script", type="application/ld+json")
+    json_ld_text = script_tag.string if script_tag else None
+
+    # 1. あらすじ取得
+    synopsis = ""
+    if json_ld_text:
+        try:
+            clean_string = json_ld_text.encode('utf-8').decode('utf-8')
+            json_data = json.loads(clean_string)
+            synopsis = json_data.get("description", "")
+        except Exception:
+            synopsis = ""
+
+    if not synopsis:
+        description_div = soup.select_one("div#comic_description p")
+        if description_div:
+            for br in description_div.find_all("br"):
+                br.replace_with("\n")
+            synopsis = description_div.get_text()
+
+    synopsis = synopsis.replace("<br>", "\n")
+    for phrase in exclusion_phrases:
+        synopsis = synopsis.replace(phrase, "")
+    synopsis = synopsis.strip()
+
+    # 2. ジャンル取得
+    genres = []
+    genre_tags = soup.select('.category_line_f_r_l a[href*="/genre/"]')
+    for tag in genre_tags:
+        genre_text = tag.get_text(strip=True)
+        cleaned_genre = genre_text.split('(')[0].strip()
+        renamed_genre = genre_rename_map.get(cleaned_genre, cleaned_genre)
+        genres.append(renamed_genre)
+    
+    # 3. 雑誌・レーベル取得
+    magazine = ""
+    magazine_tag = soup.select_one('span.brCramb_m > a[href*="/magazine/"]')
+    if magazine_tag:
+        magazine = magazine_tag.get_text(strip=True)
+    else:
+        publisher_tag = soup.select_one('.category_line a[href*="/publisher/"]')
+        if publisher_tag:
+            magazine = publisher_tag.get_text(strip=True)
+    
+    # 4. 作品タグ取得
+    tags = []
+    # === 変更点: ご提示のHTML構造に合わせた最終ロジック ===
+    # 「作品タグ」というテキストを持つdivを探す
+    tag_label_div = soup.find('div', class_='category_line_f_l_l', string='作品タグ')
+    if tag_label_div:
+        # その親をたどり、タグのリンクが入っているdivを探す
+        tag_container_div = tag_label_div.find_next_sibling('div', class_='category_line_f_r_l')
+        if tag_container_div:
+            # コンテナ内の全てのaタグ(リンク)を取得
+            tag_elements = tag_container_div.find_all('a')
+            for tag_element in tag_elements:
+                tags.append(tag_element.get_text(strip=True))
+    # =======================================================
+
+    return {
+        "synopsis": synopsis,
+        "genres": list(dict.fromkeys(genres)),
+        "magazine": magazine,
+        "tags": list(dict.fromkeys(tags))
+    }
+
+def property_name(database, name):
+    """既定のプロパティ名に対応する、データベースでの実際のプロパティ名を返す"""
+    return database.property_names.get(name, name)
+
+def to_page_record(page, database):
+    """クエリ結果のページ(JSON)をPageRecordに変換する"""
+    page_properties = page.get("properties", {})
+
+    # URLプロパティの確認
+    url = page_properties.get(property_name(database, "URL"), {}).get("url") or ""
+
+    # タイトルプロパティの確認
+    title_text = page_properties.get(property_name(database, "タイトル"), {}).get("title", [])
+    title = title_text[0].get("plain_text", "タイトルなし") if title_text else "タイトルなし"
+
+    # あらすじプロパティの確認
+    synopsis_prop = page_properties.get(property_name(database, "あらすじ"), {})
+    synopsis_text = synopsis_prop.get("rich_text", [])
+    synopsis_content = ""
+    if synopsis_text and len(synopsis_text) > 0:
+        synopsis_content = synopsis_text[0].get("plain_text", "").strip()
+
+    # 更新対象プロパティの現在の値（書き込みが必要かの判定に使う）
+    write_names = [property_name(database, name) for name in WRITE_PROPERTIES]
+    current_values = {
+        name: simplify_property_value(page_properties[name])
+        for name in write_names if name in page_properties
+    }
+
+    return PageRecord(page["id"], url, title, bool(synopsis_content), current_values, database)
+
+def notion_id(value):
+    """比較できるよう、NotionのID（ハイフンの有無が異なる）を正規化する"""
+    return (value or "").replace("-", "").lower()
+
+def page_in_database(page, database, data_source_id):
+    """ページの親が、このデータベース（データソース）かどうかを判定する"""
+    parent = page.get("parent") or {}
+    if parent.get("data_source_id"):
+        return notion_id(parent["data_source_id"]) == notion_id(data_source_id)
+    return bool(parent.get("database_id")) and notion_id(parent["database_id"]) == notion_id(database.database_id)
+
+def is_target_page(record):
+    """URLが設定されていて、あらすじが空のページかどうかを判定する"""
+    return bool(record.url) and not record.has_synopsis
+
+def process_page(record, index):
+    """1ページ分のスクレイピングとNotionの更新を行う
+
+    戻り値は "updated"（更新済み・変更なし）、"no_data"（取得失敗・あらすじなし）、
+    "queued"（次回に再試行）、"failed"（更新失敗）、"deferred"（サーキットブレーカーにより取得を延期）、
+    "retry"（一時的な障害で取得できず、後で再試行が必要）、"rejected"（Notionが更新内容を受け付けず、再試行しても成功しない）のいずれか。
+    同じURLで一時的な障害が続き、失敗記録により再試行待ちにした場合は "no_data" を返す
+    """
+    page_id, url, title = record.page_id, record.url, record.title
+
+    # 並列実行時に出力が混ざらないよう、ページ単位でまとめて出力する
+    logs = [f"\n[{index}] 処理中: {title}", f"URL: {url}"]
+    result = "no_data"
+
+    try:
+        if scrape_dedup:
+            cmoa_data, shared = scrape_dedup.scrape(url)
+        else:
+            cmoa_data, shared = scrape_cmoa_data(url), False
+    except CircuitOpenError as e:
+        logs.append(f"取得を延期しました: {e}")
+        print("\n".join(logs))
+        return "deferred"
+    except ScrapeTemporaryError as e:
+        if e.backing_off:
+            # 同じURLで失敗が続いている場合は失敗記録の再試行待ちに任せ、同期状態の更新を止めない
+            logs.append(f"一時的な障害が続いているため取得できませんでした（再試行待ちにします）: {e}")
+            print("\n".join(logs))
+            return "no_data"
+        logs.append(f"一時的な障害のため取得できませんでした（後で再試行します）: {e}")
+        print("\n".join(logs))
+        return "retry"
+    if shared:
+        logs.append("同じ作品の取得結果を使います。")
+
+    if cmoa_data and cmoa_data["synopsis"]:
+        logs.append(f"取得したデータ:")
+        logs.append(f"  あらすじ: {cmoa_data['synopsis'][:100]}...")
+        logs.append(f"  ジャンル: {cmoa_data['genres']}")
+        logs.append(f"  雑誌・レーベル: {cmoa_data['magazine']}")
+        logs.append(f"  タグ: {cmoa_data['tags']}")
+
+        properties_to_update = build_properties_to_update(cmoa_data, record.database)
+        status, message = update_notion_page(record.database, page_id, properties_to_update, record.current_values)
+        if status in ("updated", "unchanged"):
+            logs.append(f"成功: {title} の情報を更新しました。({message})")
+            result = "updated"
+        else:
+            logs.append(f"Notionの更新に失敗しました: {message}")
+            result = "failed"
+            if status == "retry" and retry_queue:
+                retry_queue.add(record.database.database_id, page_id, title, properties_to_update)
+                logs.append("次回の実行で再試行します。")
+                result = "queued"
+            elif status == "rejected":
+                logs.append("再試行しても成功しないため、このページの更新を諦めます。")
+                result = "rejected"
+    else:
+        logs.append(f"データ取得に失敗またはあらすじが空です。")
+
+    print("\n".join(logs))
+    return result
+
+def target_pages_conditions(database):
+    """処理対象（URLあり + あらすじ空）をサーバー側で絞り込むためのフィルタ条件を返す"""
+    return [
+        {"property": property_name(database, "URL"), "url": {"is_not_empty": True}},
+        {"property": property_name(database, "あらすじ"), "rich_text": {"is_empty": True}}
+    ]
+
+def build_query_filter(database, edited_since=None):
+    """データソースクエリのフィルタを作成する（条件がなければNone）"""
+    conditions = target_pages_conditions(database) if NOTION_SERVER_FILTER else []
+    if edited_since:
+        # 新しく作成されたページも、作成時刻が最終更新時刻になるためこの条件に含まれる
+        conditions.append({"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": edited_since}})
+    if not conditions:
+        return None
+    return {"and": conditions}
+
+def projection_params(properties, names):
+    """指定したプロパティだけを返すためのクエリパラメータを返す（プロパティIDが不明ならNone）"""
+    property_ids = [properties.get(name, {}).get("id") for name in names]
+    if not all(property_ids):
+        return None
+    return {"filter_properties": property_ids}
+
+def new_query_stats():
+    """iter_target_pages が集計するクエリの統計を初期化する"""
+    return {
+        "page_count": 0, "scanned_count": 0, "target_count": 0, "request_count": 0, "bytes_received": 0,
+        "backoff_count": 0, "poisoned_count": 0, "completed": False, "first_query_at": None,
+    }
+
+def iter_target_pages(database, data_source_id, properties, stats, edited_since=None):
+    """データソースをページネーションしながら、対象ページのレコードを順次返す
+
+    最後のページまで取得しきった場合は stats["completed"] を True にする
+    """
+    # データソースクエリのREST APIエンドポイント（新しいAPIバージョン）
+    path = f'/data_sources/{data_source_id}/query'
+
+    print(f"REST APIエンドポイント: {NOTION_API_BASE}{path}")
+
+    # 必要なプロパティだけを返すよう、プロパティIDで絞り込む
+    projected = [property_name(database, name) for name in PROJECTED_PROPERTIES]
+    params = projection_params(properties, projected)
+    if params:
+        print(f"取得するプロパティ: {projected}")
+    else:
+        print("プロパティIDが不明なため、全プロパティを取得します。")
+
+    # ページネーション処理（最新のページから順番に取得）
+    has_more = True
+    start_cursor = None
+    max_pages_to_check = MAX_QUERY_PAGES  # 既定では最大50ページ（5000件）までチェック
+    max_target_pages = MAX_TARGET_PAGES  # 既定では最大100件の対象ページを見つけたら停止
+
+    if NOTION_SERVER_FILTER:
+        print("サーバー側フィルタ: URLあり + あらすじ空")
+    else:
+        print("サーバー側フィルタ: 無効（全件取得）")
+    if edited_since:
+        print(f"差分同期: {edited_since} 以降に編集されたページのみ取得します。")
+    query_filter = build_query_filter(database, edited_since)
+
+    while has_more and stats["page_count"] < max_pages_to_check:
+        try:
+            payload = {
+                "page_size": 100,
+                "sorts": [
+                    {
+                        "property": property_name(database, "ID"),
+                        "direction": "descending"
+                    }
+                ]
+            }
+
+            # 対象ページの条件をクエリに含め、不要なページを転送しないようにする
+            if query_filter:
+                payload["filter"] = query_filter
+
+            if start_cursor:
+                payload["start_cursor"] = start_cursor
+
+            print(f"REST APIリクエスト送信中... (ページ {stats['page_count'] + 1})")
+            if stats["first_query_at"] is None:
+                stats["first_query_at"] = time.monotonic()
+            response = notion_request(database, "POST", path, params=params, json=payload)
+            stats["request_count"] += 1
+            stats["bytes_received"] += len(response.content)
+
+            if response.status_code != 200:
+                print(f"REST APIエラー: {response.status_code} - {response.text}")
+                stats["schema_error"] = is_schema_error(response)
+                return
+
+            data = response.json()
+            # ページ全体のJSONは保持せず、すぐに軽量なレコードへ変換する
+            batch_results = [to_page_record(page, database) for page in data.get("results", [])]
+            has_more = data.get("has_more", False)
+            start_cursor = data.get("next_cursor")
+            stats["page_count"] += 1
+            stats["scanned_count"] += len(batch_results)
+        except Exception as rest_error:
+            print(f"REST APIリクエストエラー: {rest_error}")
+            return
+
+        # サーバー側で絞り込み済みだが、念のためクライアント側でも条件を確認する
+        batch_targets = [record for record in batch_results if is_target_page(record)]
+        print(f"ページ {stats['page_count']} 取得完了。今回: {len(batch_results)}件、対象: {len(batch_targets)}件、累計: {stats['scanned_count']}件、対象累計: {stats['target_count'] + len(batch_targets)}件")
+
+        for record in batch_targets:
+            # 取得に失敗し続けているURLは、再試行の時刻になるまで対象ページの上限に数えずに飛ばす
+            skipped = scrape_failure_status(record.url)
+            if skipped:
+                stats[f"{skipped}_count"] += 1
+                continue
+
+            # 処理キューが一杯の間はここで待機するため、取得が処理を追い越しすぎることはない
+            yield record
+            stats["target_count"] += 1
+
+            # 十分な対象ページが見つかったら停止
+            if stats["target_count"] >= max_target_pages:
+                print(f"対象ページが{max_target_pages}件に達したため、取得を停止します。")
+                return
+
+    stats["completed"] = not has_more
+
+def is_schema_error(response):
+    """キャッシュしたスキーマが古いために起きたエラー（プロパティやデータソースが見つからない）かどうかを判定する"""
+    if response.status_code not in (400, 404):
+        return False
+    try:
+        return response.json().get("code") in ("validation_error", "object_not_found")
+    except ValueError:
+        return False
+
+def iter_target_pages_with_schema(database, schema, stats, edited_since=None):
+    """iter_target_pages と同じだが、スキーマの不一致でクエリが失敗した場合はスキーマを取得し直す
+
+    まだ1ページも取得していなければ、データソースIDが変わっていない限りそのまま取得し直す
+    """
+    yield from iter_target_pages(database, schema["data_source_id"], schema["properties"], stats, edited_since)
+    if not stats.get("schema_error") or schema["source"] != "cache":
+        return
+
+    print("スキーマの不一致でクエリに失敗したため、データソースとプロパティ情報を取得し直します。")
+    refreshed = resolve_schema(database, refresh=True)
+    if refreshed is None or stats["page_count"]:
+        return
+    if refreshed["data_source_id"] != schema["data_source_id"]:
+        # 同期状態はデータソースごとに記録しているため、新しいデータソースは次回の実行で最初から取得する
+        print("データソースIDが変わったため、次回の実行で新しいデータソースを取得します。")
+        return
+    schema.update(refreshed)
+    stats["schema_error"] = False
+    yield from iter_target_pages(database, schema["data_source_id"], schema["properties"], stats, edited_since)
+
+def run_pipeline(records, on_done=None):
+    """対象ページを受け取りながら、ワーカースレッドで並行してスクレイピングと更新を行う
+
+    on_done を指定すると、ページごとの処理が終わるたびに on_done(record, result) を呼ぶ
+    """
+    work_queue = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+    results = {"processed": 0, "succeeded": 0, "failed": 0, "deferred": 0, "retry": 0, "rejected": 0, "first_update_at": None}
+    results_lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            index, record = item
+            try:
+                with metrics.timer("page.process"):
+                    result = process_page(record, index)
+            except Exception as e:
+                print(f"ページの処理中にエラーが発生しました: {record.title} - {e}")
+                result = "failed"
+            metrics.increment(f"pages.{result}")
+            if on_done:
+                on_done(record, result)
+            with results_lock:
+                results["processed"] += 1
+                if result in ("failed", "deferred", "retry", "rejected"):
+                    results[result] += 1
+                if result == "updated":
+                    results["succeeded"] += 1
+                    if results["first_update_at"] is None:
+                        results["first_update_at"] = time.monotonic()
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, SYNC_CONCURRENCY))]
+    for thread in workers:
+        thread.start()
+    try:
+        for index, record in enumerate(records, 1):
+            if index <= 3:
+                print(f"  対象ページ {index}: {record.title} - {record.url}")
+            work_queue.put((index, record))
+    finally:
+        # 取得が途中で失敗しても、投入済みのページは処理しきってから終了する
+        for _ in workers:
+            work_queue.put(None)
+        for thread in workers:
+            thread.join()
+    return results
+
+def schema_hash(data_source_id, properties):
+    """データソースIDとプロパティ（名前・ID・型）から、スキーマを識別するハッシュを計算する"""
+    fields = sorted((name, prop.get("id"), prop.get("type")) for name, prop in properties.items())
+    canonical = json.dumps([data_source_id, fields], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+def load_schema_cache_file():
+    """スキーマキャッシュのファイル（データベースIDごとのエントリ）を読み込む"""
+    try:
+        with open(SCHEMA_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"スキーマキャッシュを読み込めなかったため、Notion APIから取得します: {e}")
+        return {}
+
+def fetch_schema(database):
+    """データベースとデータソースを取得し、データソースIDとプロパティ情報を返す（失敗時はNone）"""
+    print("データベース情報を取得中...")
+    try:
+        db_response = notion_request(database, "GET", f'/databases/{database.database_id}')
+        if db_response.status_code != 200:
+            print(f"データベース情報の取得に失敗しました: {db_response.status_code}")
+            print(f"エラー内容: {db_response.text}")
+            return None
+        db_info = db_response.json()
+        print("データベース情報の取得に成功しました。")
+        print(f"データベースタイトル: {db_info.get('title', [{}])[0].get('plain_text', 'N/A')}")
+
+        # データソース情報を取得
+        data_sources = db_info.get('data_sources', [])
+        print(f"データソース数: {len(data_sources)}")
+        if not data_sources:
+            print("データソースが見つかりません。")
+            return None
+        data_source_id = data_sources[0]['id']
+        print(f"使用するデータソースID: {data_source_id}")
+
+        # プロパティ情報を取得（データソースから）
+        print("データソースのプロパティ情報を取得中...")
+        ds_response = notion_request(database, "GET", f'/data_sources/{data_source_id}')
+        if ds_response.status_code == 200:
+            properties = ds_response.json().get('properties', {})
+            print(f"利用可能なプロパティ: {list(properties.keys())}")
+        else:
+            print(f"データソース情報の取得に失敗しました: {ds_response.status_code}")
+            # フォールバック: 古い方法でプロパティを取得
+            properties = db_info.get('properties', {})
+            print(f"フォールバック - 利用可能なプロパティ: {list(properties.keys())}")
+    except Exception as db_error:
+        print(f"データベース情報の取得中にエラーが発生しました: {db_error}")
+        return None
+
+    for name in ("URL", "あらすじ"):
+        if property_name(database, name) in properties:
+            print(f"{name}プロパティのタイプ: {properties[property_name(database, name)].get('type')}")
+
+    # クエリに必要なのはプロパティのIDと型だけなので、それ以外（選択肢の一覧など）は保存しない
+    properties = {name: {"id": prop.get("id"), "type": prop.get("type")} for name, prop in properties.items()}
+    return {
+        "data_source_id": data_source_id,
+        "properties": properties,
+        "schema_hash": schema_hash(data_source_id, properties),
+        "fetched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+def resolve_schema(database, refresh=False):
+    """データソースIDとプロパティ情報を返す（キャッシュがあれば使い、なければ取得して保存する）
+
+    戻り値の source はキャッシュから読んだ場合 "cache"、Notion APIから取得した場合 "api"
+    """
+    cached = load_schema_cache_file().get(database.database_id) if SCHEMA_CACHE_PATH else None
+    # 手で編集されたなどで中身とハッシュが合わないエントリは使わない
+    if cached and cached.get("schema_hash") != schema_hash(cached.get("data_source_id"), cached.get("properties") or {}):
+        cached = None
+    if cached and not refresh:
+        print(f"キャッシュしたスキーマを使用します: データソースID {cached['data_source_id']}"
+              f"（ハッシュ {cached['schema_hash']}、{cached['fetched_at']} に取得）")
+        return dict(cached, source="cache")
+
+    entry = fetch_schema(database)
+    if entry is None:
+        return None
+    if cached and cached["schema_hash"] != entry["schema_hash"]:
+        print(f"スキーマが変更されていました: {cached['schema_hash']} -> {entry['schema_hash']}")
+    if SCHEMA_CACHE_PATH:
+        try:
+            entries = load_schema_cache_file()
+            entries[database.database_id] = entry
+            write_file_atomic(SCHEMA_CACHE_PATH, json.dumps(entries, ensure_ascii=False, indent=2))
+        except OSError as e:
+            print(f"スキーマキャッシュを保存できませんでした: {e}")
+    return dict(entry, source="api")
+
+def load_sync_state():
+    """前回までの同期状態（データソースごとの最終成功時刻など）を読み込む"""
+    try:
+        with open(SYNC_STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"同期状態を読み込めなかったため、全件をチェックします: {e}")
+        return {}
+
+def save_sync_state(state):
+    """同期状態を保存する"""
+    write_file_atomic(SYNC_STATE_PATH, json.dumps(state, ensure_ascii=False, indent=2))
+
+def resolve_edited_since(source_state, full_scan):
+    """差分同期の基準時刻を返す（全件チェックする場合はNone）"""
+    if full_scan:
+        print("全件チェックが指定されました。")
+        return None
+    last_success = source_state.get("last_success")
+    if not last_success:
+        print("前回の同期記録がないため、全件をチェックします。")
+        return None
+    last_full_scan = source_state.get("last_full_scan")
+    if FULL_SCAN_INTERVAL_HOURS > 0 and (
+        not last_full_scan
+        or datetime.now(timezone.utc) - datetime.fromisoformat(last_full_scan) >= timedelta(hours=FULL_SCAN_INTERVAL_HOURS)
+    ):
+        print(f"前回の全件チェックから{FULL_SCAN_INTERVAL_HOURS:g}時間以上経過したため、全件をチェックします。")
+        return None
+    edited_since = datetime.fromisoformat(last_success) - timedelta(seconds=WATERMARK_OVERLAP_SECONDS)
+    return edited_since.isoformat(timespec="seconds")
+
+def format_prometheus_metrics(report):
+    """実行レポートをPrometheusのテキスト形式に変換する"""
+    lines = [
+        "# HELP notion_sync_stage_duration_seconds ステージごとの処理時間",
+        "# TYPE notion_sync_stage_duration_seconds histogram",
+    ]
+    for stage, data in report.get("stages", {}).items():
+        for bound, count in data["buckets"].items():
+            lines.append(f'notion_sync_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'notion_sync_stage_duration_seconds_sum{{stage="{stage}"}} {data["total_seconds"]}')
+        lines.append(f'notion_sync_stage_duration_seconds_count{{stage="{stage}"}} {data["count"]}')
+
+    lines += ["# HELP notion_sync_events_total 実行中に発生したイベントの回数", "# TYPE notion_sync_events_total counter"]
+    for name, value in report.get("counters", {}).items():
+        lines.append(f'notion_sync_events_total{{event="{name}"}} {value}')
+
+    # 件数などの集計値は、セクション名と項目名をつないだゲージとして出力する
+    for section in ("pages", "query", "notion", "scrape_cache", "scrape_dedup", "daemon"):
+        for key, value in (report.get(section) or {}).items():
+            if isinstance(value, (int, float)):
+                name = f"notion_sync_{section}_{key}"
+                lines += [f"# TYPE {name} gauge", f"{name} {int(value) if isinstance(value, bool) else value}"]
+
+    finished = datetime.fromisoformat(report["finished_at"]).timestamp()
+    lines += [
+        "# TYPE notion_sync_run_duration_seconds gauge",
+        f"notion_sync_run_duration_seconds {report['wall_seconds']}",
+        "# TYPE notion_sync_run_finished_timestamp_seconds gauge",
+        f"notion_sync_run_finished_timestamp_seconds {finished:.0f}",
+        "# TYPE notion_sync_run_success gauge",
+        f"notion_sync_run_success {1 if report['status'] == 'ok' else 0}",
+    ]
+    return "\n".join(lines) + "\n"
+
+def write_run_report(report):
+    """実行レポートをJSONで保存する（PROMETHEUS_TEXTFILEが指定されていればPrometheus形式でも出力する）"""
+    try:
+        if RUN_REPORT_PATH:
+            write_file_atomic(RUN_REPORT_PATH, json.dumps(report, ensure_ascii=False, indent=2))
+            print(f"実行レポートを保存しました: {RUN_REPORT_PATH}")
+        if PROMETHEUS_TEXTFILE:
+            write_file_atomic(PROMETHEUS_TEXTFILE, format_prometheus_metrics(report))
+    except OSError as e:
+        print(f"実行レポートを保存できませんでした: {e}")
+
+def print_stage_summary(stages):
+    """ステージごとの処理時間を表示する"""
+    if not stages:
+        return
+    print(f"{'ステージ':<28} {'回数':>6} {'合計(秒)':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'最大(ms)':>9}")
+    for stage, data in stages.items():
+        print(f"{stage:<28} {data['count']:>6} {data['total_seconds']:>9.1f} {data['p50_ms']:>9.1f} {data['p95_ms']:>9.1f} {data['max_ms']:>9.1f}")
+
+def print_dedup_summary(dedup):
+    """同じ作品のURLをまとめた結果を表示する"""
+    if dedup["shared"]:
+        print(f"重複した作品のまとめ: 対象 {dedup['pages']}件、取得 {dedup['fetched']}件、"
+              f"結果を共有 {dedup['shared']}件（{dedup['ratio']:.1%}）")
+
+def run_with_profile(path, func, *args, **kwargs):
+    """cProfileで計測しながら関数を実行し、結果を保存して上位の関数を表示する"""
+    import cProfile
+    import pstats
+
+    # ワーカースレッドの処理も計測できるよう、スレッドごとにプロファイラを用意して最後にまとめる
+    # （Python 3.12以降は1つのプロファイラで全スレッドが計測される）
+    profilers = [cProfile.Profile()]
+    profilers_lock = threading.Lock()
+
+    def start_thread_profiler(frame, event, arg):
+        profiler = cProfile.Profile()
+        with profilers_lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    if sys.version_info < (3, 12):
+        threading.setprofile(start_thread_profiler)
+    profilers[0].enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profilers[0].disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(*profilers, stream=sys.stdout)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        stats.dump_stats(path)
+        print(f"\nプロファイル結果を保存しました: {path}（累積時間の上位25件）")
+        stats.sort_stats("cumulative").print_stats(25)
+
+def load_database_configs(config_path):
+    """同期するデータベースの設定を読み込む（設定ファイルがなければ環境変数の1つだけ。エラー時はNone）
+
+    設定ファイルの例:
+        {"databases": [
+            {"name": "manga", "database_id": "...", "api_key_env": "NOTION_API_KEY",
+             "properties": {"あらすじ": "概要", "タイトル": "作品名"}}
+        ]}
+    api_key_env はAPIトークンを読み込む環境変数の名前（省略すると NOTION_API_KEY）。
+    properties には既定の名前（MAPPED_PROPERTIES）と異なるプロパティだけを指定する
+    """
+    if not config_path:
+        if not NOTION_API_KEY or not DATABASE_ID:
+            print("エラー: 環境変数 NOTION_API_KEY と DATABASE_ID が設定されていません。")
+            return None
+        return [DatabaseConfig(DATABASE_ID, DATABASE_ID, NOTION_API_KEY, {})]
+
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            entries = json.load(f)["databases"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"エラー: 設定ファイルを読み込めませんでした: {config_path} - {e!r}")
+        return None
+    databases = []
+    for index, entry in enumerate(entries, 1):
+        entry = entry if isinstance(entry, dict) else {}
+        database_id = entry.get("database_id")
+        name = entry.get("name") or database_id
+        api_key_env = entry.get("api_key_env") or "NOTION_API_KEY"
+        property_names = entry.get("properties") or {}
+        unknown = sorted(set(property_names) - set(MAPPED_PROPERTIES))
+        if not database_id:
+            error = "database_id がありません"
+        elif not os.getenv(api_key_env):
+            error = f"環境変数 {api_key_env} が設定されていません"
+        elif unknown:
+            error = f"名前を変更できないプロパティ {unknown} が指定されています（指定できるのは {MAPPED_PROPERTIES}）"
+        elif any(database.name == name for database in databases):
+            error = f"名前 {name} が重複しています"
+        else:
+            databases.append(DatabaseConfig(name, database_id, os.getenv(api_key_env), dict(property_names)))
+            continue
+        print(f"エラー: 設定ファイルの{index}番目のデータベース: {error}")
+        return None
+    if not databases:
+        print(f"エラー: 設定ファイルにデータベースがありません: {config_path}")
+        return None
+    return databases
+
+def select_databases(config_path, database_name=None):
+    """処理するデータベースを返す（database_name を指定した場合はその1つだけ。エラー時はNone）"""
+    databases = load_database_configs(config_path)
+    if databases is None or not database_name:
+        return databases
+    selected = [database for database in databases if database_name in (database.name, database.database_id)]
+    if not selected:
+        print(f"エラー: データベース {database_name} は設定にありません（{[database.name for database in databases]}）")
+        return None
+    return selected
+
+def select_database(config_path, database_name, command):
+    """常駐モード・一括処理で処理するデータベースを1つ返す（決められない場合はNone）"""
+    databases = select_databases(config_path, database_name)
+    if databases and len(databases) > 1:
+        print(f"エラー: {command}では --database で対象のデータベースを1つ指定してください"
+              f"（{[database.name for database in databases]}）")
+        return None
+    return databases[0] if databases else None
+
+def database_label(database):
+    """表示用のデータベース名（名前がIDと異なる場合は両方）"""
+    if database.name == database.database_id:
+        return database.database_id
+    return f"{database.name}（ID: {database.database_id}）"
+
+def open_run_resources():
+    """HTML解析方法を確認し、スクレイピングキャッシュ・再試行キュー・重複取得のインデックスを用意する"""
+    global CMOA_PARSER
+    if not cmoa_parser_available(CMOA_PARSER):
+        print(f"HTML解析方法 {CMOA_PARSER} は使えないため、strained で解析します。")
+        CMOA_PARSER = "strained"
+
+    global scrape_cache
+    if SCRAPE_CACHE_PATH:
+        try:
+            scrape_cache = ScrapeCache(SCRAPE_CACHE_PATH, SCRAPE_CACHE_TTL, SCRAPE_CACHE_MAX_ENTRIES)
+        except sqlite3.Error as cache_error:
+            print(f"スクレイピングキャッシュを開けなかったため、キャッシュなしで実行します: {cache_error}")
+
+    global retry_queue
+    if RETRY_QUEUE_PATH:
+        retry_queue = RetryQueue(RETRY_QUEUE_PATH)
+
+    global scrape_dedup
+    scrape_dedup = ScrapeDedup()
+
+def main(full_scan=False, config_path=SYNC_CONFIG_PATH, database_name=None):
+    """メイン処理（同期を実行し、実行レポートを出力する）"""
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "full_scan": full_scan,
+        "status": "error",
+    }
+    started = time.monotonic()
+    try:
+        run_sync(full_scan, report, config_path, database_name)
+    finally:
+        finish_run_report(report, started)
+
+def finish_run_report(report, started):
+    """実行レポートに所要時間と計測結果を加えて出力する"""
+    report["finished_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    report["wall_seconds"] = round(time.monotonic() - started, 3)
+    report.update(metrics.snapshot())
+    print_stage_summary(report["stages"])
+    write_run_report(report)
+
+def run_sync(full_scan, report, config_path=SYNC_CONFIG_PATH, database_name=None):
+    """同期処理（集計結果は report に書き込む）
+
+    設定した全データベースを順にクエリし、見つかった対象ページは共通のワーカーで処理する
+    """
+    databases = select_databases(config_path, database_name)
+    if databases is None:
         return
         
     print("Notionデータベースのチェックを開始します...")
+    started = time.monotonic()
+    # 同期状態には実行開始時刻を記録する（実行中に編集されたページを次回取りこぼさないため）
+    run_started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    open_run_resources()
+    if retry_queue:
+        for database in databases:
+            drain_retry_queue(database)
     
-    try:
-        # データベースの存在確認
-        print(f"データベースID: {DATABASE_ID}")
-        
-        # データベース情報を取得（新しいAPIバージョン対応）
-        print("データベース情報を取得中...")
-        
-        # まず新しいAPIバージョンでデータベース情報を取得
-        headers = {
-            'Authorization': f'Bearer {NOTION_API_KEY}',
-            'Notion-Version': '2025-09-03',
-            'Content-Type': 'application/json'
+    # データベースごとのデータソースIDとプロパティ情報（キャッシュがあればNotion APIは呼ばない）と同期状態
+    sync_state = load_sync_state() if SYNC_STATE_PATH else {}
+    targets = []
+    report["databases"] = {}
+    for database in databases:
+        print(f"データベース: {database_label(database)}")
+        database_report = report["databases"][database.name] = {"database_id": database.database_id, "status": "error"}
+        schema = resolve_schema(database)
+        if schema is None:
+            continue
+        source_state = sync_state.get(schema["data_source_id"], {})
+        edited_since = resolve_edited_since(source_state, full_scan) if SYNC_STATE_PATH else None
+        database_report["schema"] = {key: schema[key] for key in ("data_source_id", "schema_hash", "source")}
+        database_report["edited_since"] = edited_since
+        targets.append({
+            "database": database,
+            "schema": schema,
+            "source_state": source_state,
+            "edited_since": edited_since,
+            "query_stats": new_query_stats(),
+            "pages": {"processed": 0, "succeeded": 0, "failed": 0, "deferred": 0, "retry": 0, "rejected": 0},
+        })
+    pages_by_database = {target["database"].name: target["pages"] for target in targets}
+    pages_lock = threading.Lock()
+
+    # REST APIでページを取得し、取得しながら順次処理する
+    def target_records():
+        for target in targets:
+            yield from iter_target_pages_with_schema(
+                target["database"], target["schema"], target["query_stats"], target["edited_since"]
+            )
+
+    def on_done(record, result):
+        with pages_lock:
+            pages = pages_by_database[record.database.name]
+            pages["processed"] += 1
+            if result in ("failed", "deferred", "retry", "rejected"):
+                pages[result] += 1
+            if result == "updated":
+                pages["succeeded"] += 1
+
+    print(f"同時処理数: {SYNC_CONCURRENCY}、cmoa.jp: {CMOA_RATE_PER_SEC}回/秒、Notion: {NOTION_RATE_PER_SEC}回/秒（APIトークンごと）")
+    results = run_pipeline(target_records(), on_done=on_done)
+    elapsed = time.monotonic() - started
+
+    query_stats = sum_query_stats([target["query_stats"] for target in targets])
+    first_query_at = min((target["query_stats"]["first_query_at"] for target in targets
+                          if target["query_stats"]["first_query_at"] is not None), default=None)
+    report["query"] = query_stats
+    if first_query_at is not None:
+        report["seconds_to_first_query"] = round(first_query_at - PROCESS_STARTED, 3)
+    report["pages"] = {
+        "processed": results["processed"],
+        "succeeded": results["succeeded"],
+        "failed": results["failed"],
+        "deferred": results["deferred"],
+        "retry": results["retry"],
+        "rejected": results["rejected"],
+        "seconds_to_first_update": (
+            round(results["first_update_at"] - started, 3) if results["first_update_at"] is not None else None
+        ),
+    }
+    report["scrape_cache"] = dict(scrape_cache.stats) if scrape_cache else None
+    report["scrape_dedup"] = scrape_dedup.report()
+    report["notion"] = dict(notion_stats)
+    report["connections"] = connection_stats()
+    report["circuit_breakers"] = circuit_breaker_stats()
+
+    state_changed = False
+    for target in targets:
+        database, schema, stats, pages = target["database"], target["schema"], target["query_stats"], target["pages"]
+        database_report = report["databases"][database.name]
+        database_report["query"] = {key: value for key, value in stats.items() if key != "first_query_at"}
+        database_report["pages"] = dict(pages)
+        # 最後まで取得でき、更新に失敗・延期したページや一時的な障害で取得できなかったページもなければ同期状態を進める
+        succeeded = stats["completed"] and not pages["failed"] and not pages["deferred"] and not pages["retry"]
+        if succeeded:
+            database_report["status"] = "ok"
+        elif stats["page_count"]:
+            database_report["status"] = "partial"
+
+        if len(targets) > 1:
+            print(f"\n--- {database_label(database)} ---")
+        if stats["request_count"]:
+            print(f"\nREST APIで取得完了。総ページ数: {stats['scanned_count']}件 (全{stats['page_count']}ページ)")
+            print(f"対象ページ（URLあり + あらすじ空）: {stats['target_count']}件")
+            print(f"クエリ統計: リクエスト数 {stats['request_count']}回、受信データ量 {stats['bytes_received'] / 1024:.1f}KB")
+            if stats["backoff_count"] or stats["poisoned_count"]:
+                print(f"取得に失敗し続けているため飛ばしたページ: 再試行待ち {stats['backoff_count']}件、"
+                      f"除外 {stats['poisoned_count']}件")
+            print(f"スキーマ: {'キャッシュ' if schema['source'] == 'cache' else 'Notion APIから取得'}")
+            if stats["page_count"] == 0:
+                print("REST APIでもページを取得できませんでした。")
+                print("データベースの権限設定を確認してください。")
+                continue
+
+        if SYNC_STATE_PATH and succeeded:
+            source_state = target["source_state"]
+            source_state["last_success"] = run_started_at
+            if target["edited_since"] is None:
+                source_state["last_full_scan"] = run_started_at
+            sync_state[schema["data_source_id"]] = source_state
+            state_changed = True
+            print(f"同期状態を更新しました: {run_started_at}")
+        elif SYNC_STATE_PATH:
+            print("取得が途中で終わったか、更新に失敗・延期したページや一時的な障害で取得できなかったページがあるため、同期状態は更新しません。")
+    if state_changed:
+        save_sync_state(sync_state)
+
+    statuses = [database_report["status"] for database_report in report["databases"].values()]
+    if statuses and all(status == "ok" for status in statuses):
+        report["status"] = "ok"
+    elif query_stats["page_count"]:
+        report["status"] = "partial"
+    if first_query_at is not None:
+        print(f"\n起動から最初のクエリまでの時間: {report['seconds_to_first_query']:.2f}秒")
+
+    processed = results["processed"]
+    if not processed:
+        print("処理対象のページは見つかりませんでした。")
+        return
+
+    succeeded = results["succeeded"]
+    print(f"\n処理が完了しました。{processed}件のページを処理しました。(成功: {succeeded}件、失敗: {processed - succeeded}件)")
+    print(f"処理時間: {elapsed:.1f}秒 ({processed / elapsed if elapsed > 0 else 0:.2f}ページ/秒)")
+    if results["deferred"]:
+        print(f"サーキットブレーカーにより取得を延期したページ: {results['deferred']}件")
+    if results["retry"]:
+        print(f"一時的な障害のため取得できなかったページ: {results['retry']}件（次回の実行で再試行します）")
+    if results["rejected"]:
+        print(f"Notionが更新内容を受け付けなかったため、更新を諦めたページ: {results['rejected']}件")
+    print_dedup_summary(report["scrape_dedup"])
+    if results["first_update_at"] is not None:
+        print(f"最初の更新までの時間: {results['first_update_at'] - started:.1f}秒")
+    if scrape_cache:
+        cache_stats = scrape_cache.stats
+        print(f"スクレイピングキャッシュ: ヒット {cache_stats['hits']}件、再検証(304) {cache_stats['revalidated']}件、"
+              f"期限切れ {cache_stats['stale']}件、ミス {cache_stats['misses']}件、削除 {cache_stats['evictions']}件")
+        scrape_cache.close()
+    print(f"Notion更新: 書き込み {notion_stats['updated']}件、変更なしで省略 {notion_stats['unchanged']}件、"
+          f"再試行キューへ追加 {notion_stats['queued']}件、APIの再試行 {notion_stats['retries']}回")
+    for host, stats in connection_stats().items():
+        reused = stats["requests"] - stats["connections"]
+        print(f"HTTP接続 ({host}): リクエスト {stats['requests']}回、新規接続 {stats['connections']}回、接続の再利用 {max(reused, 0)}回")
+
+class SyncDaemon:
+    """常駐モードの本体: 定期的にデータソースの差分を取得し、対象ページを優先度付きキューでワーカーに渡す"""
+
+    def __init__(self, database, schema, full_scan=False):
+        self.database = database
+        self.schema = schema
+        self.data_source_id = schema["data_source_id"]
+        self.work_queue = queue.PriorityQueue()
+        self.pending = set()  # キューにある、または処理中のページID（同じページを重複して処理しない）
+        self.recent = {}  # 差分取得で処理済みのページID -> 処理した時刻（重複期間内に再度見つかっても処理しない）
+        # 処理に失敗したページID -> キューに戻す情報（差分取得の範囲から外れても取りこぼさないよう、ここで保持する）
+        self.retry_later = {}
+        self.retry_attempts = {}  # 処理に失敗したページID -> 続けて失敗した回数
+        self.stats = {
+            "polls": 0, "poll_errors": 0, "enqueued": 0, "duplicates": 0, "webhooks": 0,
+            "processed": 0, "succeeded": 0, "failed": 0, "deferred": 0, "retry": 0, "rejected": 0,
+            "backoff_skipped": 0, "poisoned_skipped": 0,
+            "retried": 0, "gave_up": 0, "requeued": 0,
         }
-        
+        self.started = time.monotonic()
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.last_poll_ok_at = None
+        self.force_full_scan = full_scan
+        self.sync_state = load_sync_state() if SYNC_STATE_PATH else {}
+        self.source_state = dict(self.sync_state.get(self.data_source_id, {}))
+        self.unsaved_poll = None  # 完了したがまだ保存していないポーリングの同期状態
+        self.workers = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._poll_event = threading.Event()
+
+    def enqueue(self, record, priority):
+        """ページをキューに追加する（キューにある・処理中・再試行待ちのページは追加しない）"""
+        with self._lock:
+            if record.page_id in self.pending or record.page_id in self.retry_later:
+                self.stats["duplicates"] += 1
+                return False
+            self.pending.add(record.page_id)
+            self.stats["enqueued"] += 1
+        self.work_queue.put((priority, next(self._order), record))
+        return True
+
+    def enqueue_page(self, page_id):
+        """Webhookで指定されたページを確認し、対象であれば最優先でキューに追加する"""
+        with self._lock:
+            self.stats["webhooks"] += 1
         try:
-            db_response = requests.get(
-                f'https://api.notion.com/v1/databases/{DATABASE_ID}',
-                headers=headers,
-                timeout=30
-            )
-            
-            if db_response.status_code == 200:
-                db_info = db_response.json()
-                print("データベース情報の取得に成功しました。")
-                print(f"データベースタイトル: {db_info.get('title', [{}])[0].get('plain_text', 'N/A')}")
-                
-                # データソース情報を取得
-                data_sources = db_info.get('data_sources', [])
-                print(f"データソース数: {len(data_sources)}")
-                
-                if data_sources:
-                    data_source_id = data_sources[0]['id']
-                    print(f"使用するデータソースID: {data_source_id}")
-                else:
-                    print("データソースが見つかりません。")
-                    return
-                
-                # プロパティ情報を取得（データソースから）
-                print("データソースのプロパティ情報を取得中...")
-                ds_response = requests.get(
-                    f'https://api.notion.com/v1/data_sources/{data_source_id}',
-                    headers=headers,
-                    timeout=30
-                )
-                
-                if ds_response.status_code == 200:
-                    ds_info = ds_response.json()
-                    properties = ds_info.get('properties', {})
-                    print(f"利用可能なプロパティ: {list(properties.keys())}")
-                    
-                    if 'URL' in properties:
-                        print(f"URLプロパティのタイプ: {properties['URL'].get('type')}")
-                    if 'あらすじ' in properties:
-                        print(f"あらすじプロパティのタイプ: {properties['あらすじ'].get('type')}")
+            response = notion_request(self.database, "GET", f"/pages/{page_id}")
+        except requests.exceptions.RequestException as e:
+            return False, f"ページ情報の取得に失敗しました: {e}"
+        if response.status_code != 200:
+            return False, f"ページ情報の取得に失敗しました: {response.status_code}"
+        page = response.json()
+        if page.get("archived") or page.get("in_trash"):
+            return False, "削除済みのページです。"
+        # Webhookは連携しているすべてのページで届くため、他のデータベースのページは処理しない
+        if not page_in_database(page, self.database, self.data_source_id):
+            return False, "このデータベースのページではありません。"
+        record = to_page_record(page, self.database)
+        if not is_target_page(record):
+            return False, "URLが空か、あらすじが入力済みのページです。"
+        if not self.enqueue(record, SERVE_PRIORITY_WEBHOOK):
+            return False, "処理待ちまたは処理中のページです。"
+        print(f"Webhookで指定されたページをキューに追加しました: {record.title}")
+        return True, "キューに追加しました。"
+
+    def trigger_poll(self):
+        """待機中のポーリングをすぐに実行させる"""
+        with self._lock:
+            self.stats["webhooks"] += 1
+        self._poll_event.set()
+
+    def worker(self):
+        while True:
+            priority, order, record = self.work_queue.get()
+            if record is None:
+                return
+            # ドメインへのリクエストを止めている間は、再開するまで待ってから処理する
+            breaker = get_circuit_breaker(record.url)
+            while breaker.retry_in() > 0 and not self._stop_event.is_set():
+                self._stop_event.wait(min(breaker.retry_in(), 5))
+            try:
+                with metrics.timer("page.process"):
+                    result = process_page(record, order)
+            except Exception as e:
+                print(f"ページの処理中にエラーが発生しました: {record.title} - {e}")
+                result = "failed"
+            metrics.increment(f"pages.{result}")
+            if result == "deferred" and not self._stop_event.is_set():
+                # 停止時間が明けると待っていたワーカーが同時に動き出し、様子見の1件以外は延期になる。
+                # 延期したページは同じ優先度・順番でキューに戻し、リクエストを再開できるまで待ってから処理し直す
+                with self._lock:
+                    self.stats["requeued"] += 1
+                self.work_queue.put((priority, order, record))
+                continue
+            with self._lock:
+                self.pending.discard(record.page_id)
+                if result in ("failed", "retry"):
+                    self.hold_for_retry(record, priority)
                 else:
-                    print(f"データソース情報の取得に失敗しました: {ds_response.status_code}")
-                    # フォールバック: 古い方法でプロパティを取得
-                    properties = db_info.get('properties', {})
-                    print(f"フォールバック - 利用可能なプロパティ: {list(properties.keys())}")
-                    
+                    self.retry_attempts.pop(record.page_id, None)
+                    if result != "deferred":
+                        self.recent[record.page_id] = time.monotonic()
+                self.stats["processed"] += 1
+                if result in ("failed", "deferred", "retry", "rejected"):
+                    self.stats[result] += 1
+                if result == "updated":
+                    self.stats["succeeded"] += 1
+
+    def hold_for_retry(self, record, priority):
+        """処理に失敗したページを、時間を空けてキューに戻すために保持する（self._lock を取得して呼ぶ）"""
+        attempts = self.retry_attempts.get(record.page_id, 0) + 1
+        if attempts >= SERVE_RETRY_MAX_ATTEMPTS:
+            self.retry_attempts.pop(record.page_id, None)
+            self.stats["gave_up"] += 1
+            print(f"{attempts}回続けて失敗したため、次の全件チェックまで処理しません: {record.title}")
+            return
+        self.retry_attempts[record.page_id] = attempts
+        retry_at = time.monotonic() + SERVE_RETRY_DELAY * (2 ** (attempts - 1))
+        self.retry_later[record.page_id] = (retry_at, priority, record)
+
+    def requeue_due_pages(self):
+        """再試行の時刻になった、処理に失敗したページをキューに戻す"""
+        now = time.monotonic()
+        with self._lock:
+            due = [page_id for page_id, (retry_at, _, _) in self.retry_later.items() if retry_at <= now]
+            items = [self.retry_later.pop(page_id) for page_id in due]
+            for _, _, record in items:
+                self.pending.add(record.page_id)
+            self.stats["retried"] += len(items)
+        for _, priority, record in items:
+            self.work_queue.put((priority, next(self._order), record))
+        if items:
+            print(f"処理に失敗したページをキューに戻しました: {len(items)}件")
+
+    def poll_once(self):
+        """データソースの差分を取得し、対象ページをキューに追加する"""
+        self.requeue_due_pages()
+        self.save_sync_state_if_idle()
+        # 前回のポーリング以降に作品ページが更新されているかもしれないため、共有する取得結果は破棄する
+        scrape_dedup.reset()
+
+        poll_started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        edited_since = resolve_edited_since(self.source_state, self.force_full_scan)
+        priority = SERVE_PRIORITY_FULL_SCAN if edited_since is None else SERVE_PRIORITY_POLL
+        with self._lock:
+            failed_before = self.stats["failed"] + self.stats["deferred"] + self.stats["retry"]
+            # 重複期間を過ぎた処理済みの記録は不要になる
+            expires = time.monotonic() - WATERMARK_OVERLAP_SECONDS - SERVE_POLL_INTERVAL
+            self.recent = {page_id: at for page_id, at in self.recent.items() if at >= expires}
+            recent = set(self.recent) if edited_since else set()
+
+        query_stats = new_query_stats()
+        added = 0
+        for record in iter_target_pages_with_schema(self.database, self.schema, query_stats, edited_since):
+            if self._stop_event.is_set():
+                break
+            # 差分取得では、直前に処理したページ（あらすじが見つからなかったページなど）を繰り返し処理しない
+            if record.page_id not in recent and self.enqueue(record, priority):
+                added += 1
+
+        with self._lock:
+            self.stats["polls"] += 1
+            self.stats["backoff_skipped"] += query_stats["backoff_count"]
+            self.stats["poisoned_skipped"] += query_stats["poisoned_count"]
+            if query_stats["page_count"]:
+                self.last_poll_ok_at = time.monotonic()
             else:
-                print(f"データベース情報の取得に失敗しました: {db_response.status_code}")
-                print(f"エラー内容: {db_response.text}")
-                return
-                
-        except Exception as db_error:
-            print(f"データベース情報の取得中にエラーが発生しました: {db_error}")
+                self.stats["poll_errors"] += 1
+
+        if query_stats.get("schema_error"):
+            self.reload_schema()
+        elif query_stats["completed"] and not self._stop_event.is_set():
+            self.source_state["last_success"] = poll_started_at
+            if edited_since is None:
+                self.source_state["last_full_scan"] = poll_started_at
+                self.force_full_scan = False
+            self.unsaved_poll = {"state": dict(self.source_state), "failed": failed_before}
+        print(f"ポーリング完了: 追加 {added}件、処理待ち {self.work_queue.qsize()}件")
+
+    def reload_schema(self):
+        """スキーマの不一致でクエリが失敗した後、保存し直されたスキーマに切り替える"""
+        schema = resolve_schema(self.database)
+        if schema is None:
             return
-        
-        # ページを取得（利用可能なメソッドのみを使用）
-        print("ページ一覧を取得中...")
-        all_pages_results = []
-        
-        # 利用可能なメソッドを確認
-        available_methods = [method for method in dir(notion.databases) if not method.startswith('_')]
-        print(f"利用可能なdatabasesメソッド: {available_methods}")
-        
-        # 方法1: databases.listメソッドを試行（利用可能な場合）
-        if 'list' in available_methods:
+        self.schema = schema
+        if schema["data_source_id"] != self.data_source_id:
+            print(f"データソースIDが変わったため、新しいデータソースを取得します: {schema['data_source_id']}")
+            self.data_source_id = schema["data_source_id"]
+            self.source_state = dict(self.sync_state.get(self.data_source_id, {}))
+            self.unsaved_poll = None
+
+    def save_sync_state_if_idle(self):
+        """キューが空で再試行待ちのページもなく、ポーリング以降に更新の失敗がなければ、そのポーリングの同期状態を保存する"""
+        if not SYNC_STATE_PATH or self.unsaved_poll is None:
+            return
+        with self._lock:
+            failed = self.stats["failed"] + self.stats["deferred"] + self.stats["retry"]
+            if self.pending or self.retry_later or failed != self.unsaved_poll["failed"]:
+                return
+        self.sync_state[self.data_source_id] = self.unsaved_poll["state"]
+        save_sync_state(self.sync_state)
+        self.unsaved_poll = None
+
+    def drain_retry_queue_periodically(self):
+        """再試行キューを SERVE_RETRY_QUEUE_INTERVAL ごとに処理する
+
+        1回処理するごとに再試行の回数が増えるため、ポーリングより長い間隔で、ポーリングとは別のスレッドで処理する
+        """
+        while not self._stop_event.is_set():
             try:
-                print("databases.listメソッドを試行中...")
-                response = notion.databases.list()
-                all_pages_results = response.get("results", [])
-                print(f"databases.listメソッドで取得完了。総ページ数: {len(all_pages_results)}")
-                
-            except Exception as list_error:
-                print(f"databases.listメソッドでエラーが発生しました: {list_error}")
-                all_pages_results = []
-        
-        # 方法2: REST APIを直接使用してページを取得
-        if not all_pages_results:
-            print("代替手段として、REST APIを直接使用してページを取得します...")
+                drain_retry_queue(self.database)
+            except Exception as e:
+                print(f"再試行キューの処理中にエラーが発生しました: {e}")
+            self._stop_event.wait(SERVE_RETRY_QUEUE_INTERVAL)
+
+    def run(self):
+        """ワーカーを起動し、停止するまで定期的にポーリングする"""
+        self.workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(max(1, SYNC_CONCURRENCY))]
+        for thread in self.workers:
+            thread.start()
+        if retry_queue:
+            threading.Thread(target=self.drain_retry_queue_periodically, daemon=True).start()
+        while not self._stop_event.is_set():
             try:
-                # Notion APIのRESTエンドポイントを直接使用
-                headers = {
-                    'Authorization': f'Bearer {NOTION_API_KEY}',
-                    'Notion-Version': '2025-09-03',
-                    'Content-Type': 'application/json'
-                }
-                
-                # データソースクエリのREST APIエンドポイント（新しいAPIバージョン）
-                url = f'https://api.notion.com/v1/data_sources/{data_source_id}/query'
-                
-                print(f"REST APIエンドポイント: {url}")
-                
-                # ページネーション処理（最新のページから順番に取得）
-                has_more = True
-                start_cursor = None
-                page_count = 0
-                max_pages_to_check = 50  # 最大50ページ（5000件）までチェック
-                target_pages_found = 0
-                max_target_pages = 100  # 最大100件の対象ページを見つけたら停止
-                
-                while has_more and page_count < max_pages_to_check:
-                    try:
-                        payload = {
-                            "page_size": 100,
-                            "sorts": [
-                                {
-                                    "property": "ID",
-                                    "direction": "descending"
-                                }
-                            ]
-                        }
-                        
-                        if start_cursor:
-                            payload["start_cursor"] = start_cursor
-                        
-                        print(f"REST APIリクエスト送信中... (ページ {page_count + 1})")
-                        response = requests.post(url, headers=headers, json=payload, timeout=30)
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            batch_results = data.get("results", [])
-                            
-                            # このバッチ内で対象ページをカウント
-                            batch_target_count = 0
-                            for page in batch_results:
-                                page_properties = page.get("properties", {})
-                                
-                                # URLプロパティの確認
-                                url_prop = page_properties.get("URL", {})
-                                has_url = url_prop.get("url") is not None and url_prop.get("url") != ""
-                                
-                                # あらすじプロパティの確認
-                                synopsis_prop = page_properties.get("あらすじ", {})
-                                synopsis_text = synopsis_prop.get("rich_text", [])
-                                synopsis_content = ""
-                                if synopsis_text and len(synopsis_text) > 0:
-                                    synopsis_content = synopsis_text[0].get("plain_text", "").strip()
-                                
-                                has_no_synopsis = not synopsis_content or synopsis_content == ""
-                                
-                                if has_url and has_no_synopsis:
-                                    batch_target_count += 1
-                            
-                            all_pages_results.extend(batch_results)
-                            target_pages_found += batch_target_count
-                            has_more = data.get("has_more", False)
-                            start_cursor = data.get("next_cursor")
-                            page_count += 1
-                            
-                            print(f"ページ {page_count} 取得完了。今回: {len(batch_results)}件、対象: {batch_target_count}件、累計: {len(all_pages_results)}件、対象累計: {target_pages_found}件")
-                            
-                            # 十分な対象ページが見つかったら停止
-                            if target_pages_found >= max_target_pages:
-                                print(f"対象ページが{max_target_pages}件に達したため、処理を停止します。")
-                                break
-                            
-                            # レート制限を考慮して少し待機
-                            time.sleep(0.1)
-                        else:
-                            print(f"REST APIエラー: {response.status_code} - {response.text}")
-                            break
-                            
-                    except Exception as rest_error:
-                        print(f"REST APIリクエストエラー: {rest_error}")
-                        break
-                
-                print(f"REST APIで取得完了。総ページ数: {len(all_pages_results)}件 (全{page_count}ページ)")
-                print(f"対象ページ（URLあり + あらすじ空）: {target_pages_found}件")
-                
-                if not all_pages_results:
-                    print("REST APIでもページを取得できませんでした。")
-                    print("データベースの権限設定を確認してください。")
-                    return
-                
-            except Exception as rest_error:
-                print(f"REST API使用中にエラーが発生しました: {rest_error}")
+                self.poll_once()
+            except Exception as e:
+                print(f"ポーリング中にエラーが発生しました: {e}")
+                with self._lock:
+                    self.stats["poll_errors"] += 1
+            self._poll_event.wait(SERVE_POLL_INTERVAL)
+            self._poll_event.clear()
+
+    def stop(self):
+        """ポーリングを止める（処理中のページは shutdown で待つ）"""
+        self._stop_event.set()
+        self._poll_event.set()
+
+    def shutdown(self, timeout):
+        """処理中のページが終わるのを待ってワーカーを止める（処理待ちのページは次回の起動で処理する）"""
+        for _ in self.workers:
+            self.work_queue.put((-1, next(self._order), None))
+        deadline = time.monotonic() + timeout
+        for thread in self.workers:
+            thread.join(max(0, deadline - time.monotonic()))
+        remaining = sum(1 for _, _, record in list(self.work_queue.queue) if record is not None)
+        if remaining:
+            print(f"処理待ちの{remaining}件は次回の起動で処理します。")
+        self.save_sync_state_if_idle()
+
+    def health(self):
+        """ヘルスチェックの結果を (HTTPステータス, 内容) で返す"""
+        now = time.monotonic()
+        with self._lock:
+            body = dict(self.stats, queue_size=self.work_queue.qsize(), in_progress=len(self.pending),
+                        retry_waiting=len(self.retry_later))
+            last_poll_ok_at = self.last_poll_ok_at
+        body["uptime_seconds"] = round(now - self.started, 1)
+        body["last_poll_seconds_ago"] = round(now - last_poll_ok_at, 1) if last_poll_ok_at is not None else None
+        if self._stop_event.is_set():
+            body["status"] = "stopping"
+        elif last_poll_ok_at is None:
+            body["status"] = "starting" if now - self.started < SERVE_UNHEALTHY_AFTER else "unhealthy"
+        else:
+            body["status"] = "ok" if now - last_poll_ok_at < SERVE_UNHEALTHY_AFTER else "unhealthy"
+        return (200 if body["status"] in ("ok", "starting") else 503), body
+
+    def report(self):
+        """実行レポート（/metrics と終了時の出力に使う）を作成する"""
+        _, health = self.health()
+        with self._lock:
+            daemon_stats = dict(self.stats)
+        report = {
+            "mode": "serve",
+            "started_at": self.started_at,
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "wall_seconds": round(time.monotonic() - self.started, 3),
+            "database_id": self.database.database_id,
+            "status": "ok" if health["status"] in ("ok", "stopping") else health["status"],
+            "schema": {key: self.schema[key] for key in ("data_source_id", "schema_hash", "source")},
+            "daemon": daemon_stats,
+            "scrape_cache": dict(scrape_cache.stats) if scrape_cache else None,
+            "scrape_dedup": scrape_dedup.report(),
+            "notion": dict(notion_stats),
+            "connections": connection_stats(),
+            "circuit_breakers": circuit_breaker_stats(),
+        }
+        report.update(metrics.snapshot())
+        return report
+
+def make_daemon_request_handler(daemon):
+    """常駐モードのHTTPハンドラ（/healthz・/metrics・/trigger）を作成する"""
+    from http.server import BaseHTTPRequestHandler
+
+    class DaemonRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type="application/json; charset=utf-8"):
+            data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/healthz":
+                self.send_body(*daemon.health())
+            elif path == "/metrics":
+                self.send_body(200, format_prometheus_metrics(daemon.report()), "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self.send_body(404, {"error": "not found"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/trigger":
+                self.send_body(404, {"error": "not found"})
                 return
-        
-        # 手動でフィルタリング
-        print("対象ページをフィルタリング中...")
-        target_pages = {"results": []}
-        
-        # デバッグ用の統計情報
-        total_pages = len(all_pages_results)
-        pages_with_url = 0
-        pages_without_synopsis = 0
-        pages_with_both = 0
-        
-        for i, page in enumerate(all_pages_results):
-            page_properties = page.get("properties", {})
-            
-            # URLプロパティの確認
-            url_prop = page_properties.get("URL", {})
-            has_url = url_prop.get("url") is not None and url_prop.get("url") != ""
-            if has_url:
-                pages_with_url += 1
-            
-            # あらすじプロパティの確認
-            synopsis_prop = page_properties.get("あらすじ", {})
-            synopsis_text = synopsis_prop.get("rich_text", [])
-            synopsis_content = ""
-            if synopsis_text and len(synopsis_text) > 0:
-                synopsis_content = synopsis_text[0].get("plain_text", "").strip()
-            
-            has_no_synopsis = not synopsis_content or synopsis_content == ""
-            if has_no_synopsis:
-                pages_without_synopsis += 1
-            
-            # 両方の条件を満たす場合
-            if has_url and has_no_synopsis:
-                pages_with_both += 1
-                target_pages["results"].append(page)
-                
-                # 最初の数件の詳細を表示
-                if pages_with_both <= 3:
-                    title_prop = page_properties.get("タイトル", {})
-                    title = title_prop.get("title", [{}])[0].get("plain_text", "タイトルなし")
-                    url = url_prop.get("url", "")
-                    print(f"  対象ページ {pages_with_both}: {title} - {url}")
-        
-        print(f"フィルタリング統計:")
-        print(f"  総ページ数: {total_pages}")
-        print(f"  URLが設定されているページ: {pages_with_url}")
-        print(f"  あらすじが空のページ: {pages_without_synopsis}")
-        print(f"  対象ページ（URLあり + あらすじ空）: {pages_with_both}")
-        print(f"フィルタリング完了。対象ページ数: {len(target_pages['results'])}")
-        
-    except Exception as e:
-        print(f"データベース処理でエラーが発生しました: {e}")
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            except ValueError:
+                self.send_body(400, {"error": "invalid json"})
+                return
+            if not isinstance(body, dict):
+                body = {}
+            # {"page_id": ...} のほか、Notionのwebhookの形式（{"entity": {"id": ...}}）も受け付ける
+            page_id = body.get("page_id") or (body.get("entity") or {}).get("id")
+            if page_id:
+                queued, message = daemon.enqueue_page(page_id)
+                self.send_body(202, {"queued": queued, "message": message})
+            else:
+                daemon.trigger_poll()
+                self.send_body(202, {"poll": "triggered"})
+
+    return DaemonRequestHandler
+
+def serve(full_scan=False, config_path=SYNC_CONFIG_PATH, database_name=None):
+    """常駐モード: セッションとスキーマを保持したまま、ポーリングとWebhookで対象ページを処理し続ける"""
+    import signal
+    from http.server import ThreadingHTTPServer
+
+    database = select_database(config_path, database_name, "常駐モード")
+    if database is None:
         return
 
-    if not target_pages["results"]:
-        print("処理対象のページは見つかりませんでした。")
+    open_run_resources()
+    print(f"データベース: {database_label(database)}")
+    schema = resolve_schema(database)
+    if schema is None:
         return
 
-    print(f"\n処理対象のページ数: {len(target_pages['results'])}")
-    
-    for i, page in enumerate(target_pages["results"], 1):
-        page_id = page["id"]
-        url = page["properties"]["URL"]["url"]
-        title = page["properties"]["タイトル"]["title"][0]["plain_text"]
-
-        print(f"\n[{i}/{len(target_pages['results'])}] 処理中: {title}")
-        print(f"URL: {url}")
-
-        cmoa_data = scrape_cmoa_data(url)
-
-        if cmoa_data and cmoa_data["synopsis"]:
-            print(f"取得したデータ:")
-            print(f"  あらすじ: {cmoa_data['synopsis'][:100]}...")
-            print(f"  ジャンル: {cmoa_data['genres']}")
-            print(f"  雑誌・レーベル: {cmoa_data['magazine']}")
-            print(f"  タグ: {cmoa_data['tags']}")
-            
+    daemon = SyncDaemon(database, schema, full_scan)
+    httpd = ThreadingHTTPServer((SERVE_HOST, SERVE_PORT), make_daemon_request_handler(daemon))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    received = []
+
+    def handle_signal(signum, frame):
+        # シグナルハンドラは割り込まれたメインスレッドで動くため、printのロックを取らない（出力は run() を抜けてから行う）
+        received.append(signum)
+        daemon.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print(f"常駐モードで起動しました: http://{SERVE_HOST}:{httpd.server_address[1]}（/healthz・/metrics・POST /trigger）")
+    print(f"ポーリング間隔: {SERVE_POLL_INTERVAL:g}秒、同時処理数: {SYNC_CONCURRENCY}")
+    try:
+        daemon.run()
+    finally:
+        if received:
+            print(f"終了シグナル({signal.Signals(received[0]).name})を受け取りました。処理中のページが終わりしだい終了します。")
+        httpd.shutdown()
+        httpd.server_close()
+        daemon.shutdown(SERVE_SHUTDOWN_TIMEOUT)
+        report = daemon.report()
+        print_stage_summary(report["stages"])
+        write_run_report(report)
+        if scrape_cache:
+            scrape_cache.close()
+        print("常駐モードを終了しました。")
+
+def partition_kind(database, properties):
+    """パーティションの分け方を返す（IDプロパティが使えれば "id"、なければ "created_time"）"""
+    id_type = properties.get(property_name(database, "ID"), {}).get("type")
+    return "id" if id_type in ("unique_id", "number") else "created_time"
+
+def partition_sorts(database, kind, direction):
+    """パーティションのキー（IDまたは作成日時）で並べ替える条件を返す"""
+    if kind == "id":
+        return [{"property": property_name(database, "ID"), "direction": direction}]
+    return [{"timestamp": "created_time", "direction": direction}]
+
+def page_partition_key(database, page, kind):
+    """ページのパーティションのキー（ID番号または作成日時）を返す"""
+    if kind == "created_time":
+        return page.get("created_time")
+    prop = page.get("properties", {}).get(property_name(database, "ID"), {})
+    if prop.get("type") == "unique_id":
+        return (prop.get("unique_id") or {}).get("number")
+    return prop.get("number")
+
+class BackfillPartition:
+    """一括処理の1パーティション（キーの範囲と、再開位置を求めるための処理中のページ）
+
+    キーの昇順に取得するため、処理が終わっていないページのうち最小のキーから再開すれば取りこぼさない
+    """
+
+    def __init__(self, index, lower, upper, upper_inclusive, done=False):
+        self.index = index
+        self.lower = lower
+        self.upper = upper
+        self.upper_inclusive = upper_inclusive
+        self.done = done
+        self.scan_completed = done
+        self.last_key = None
+        self.in_flight = {}  # 処理待ち・処理中のページID -> キー
+        self.stats = new_query_stats()
+        self._lock = threading.Lock()
+
+    def query_filter(self, kind, id_property, id_type):
+        """このパーティションの範囲（再開位置以降）を表すフィルタ条件を返す（upper がNoneなら上限なし）"""
+        lower = self.resume_from()
+        if kind == "id":
+            condition = {"greater_than_or_equal_to": lower}
+            if self.upper is not None:
+                condition["less_than_or_equal_to" if self.upper_inclusive else "less_than"] = self.upper
+            return {"property": id_property, id_type: condition}
+        condition = {"on_or_after": lower}
+        if self.upper is not None:
+            condition["on_or_before" if self.upper_inclusive else "before"] = self.upper
+        return {"timestamp": "created_time", "created_time": condition}
+
+    def scanned(self, key):
+        with self._lock:
+            self.last_key = key
+
+    def start(self, page_id, key):
+        with self._lock:
+            self.in_flight[page_id] = key
+
+    def finish(self, page_id):
+        with self._lock:
+            self.in_flight.pop(page_id, None)
+
+    def complete_scan(self):
+        with self._lock:
+            self.scan_completed = True
+
+    def resume_from(self):
+        """再開位置（処理が終わっていないページの最小のキー、なければ最後に取得したキー）を返す"""
+        with self._lock:
+            if self.in_flight:
+                return min(self.in_flight.values())
+            return self.last_key if self.last_key is not None else self.lower
+
+    def to_checkpoint(self):
+        with self._lock:
+            done = self.scan_completed and not self.in_flight
+        return {"lower": self.resume_from(), "upper": self.upper, "upper_inclusive": self.upper_inclusive, "done": done}
+
+def fetch_partition_bounds(database, schema, kind):
+    """データソース全体の最小・最大のキーを返す（ページがない・取得に失敗した場合はNone）"""
+    path = f"/data_sources/{schema['data_source_id']}/query"
+    params = projection_params(schema["properties"], [property_name(database, "ID" if kind == "id" else "タイトル")])
+    bounds = []
+    for direction in ("ascending", "descending"):
+        payload = {"page_size": 1, "sorts": partition_sorts(database, kind, direction)}
+        response = notion_request(database, "POST", path, params=params, json=payload)
+        if response.status_code != 200:
+            print(f"REST APIエラー: {response.status_code} - {response.text}")
+            return None
+        results = response.json().get("results", [])
+        key = page_partition_key(database, results[0], kind) if results else None
+        if key is None:
+            return None
+        bounds.append(key)
+    return bounds
+
+def make_partitions(kind, lowest, highest, count):
+    """キーの範囲をほぼ同じ大きさのパーティションに分割する
+
+    最後のパーティションは上限を設けない（範囲を調べた後に追加されたページも含める）
+    """
+    count = max(1, count)
+    partitions = []
+    if kind == "id":
+        size = max(1, math.ceil((highest - lowest + 1) / count))
+        lowers = list(range(lowest, highest + 1, size))
+        for index, lower in enumerate(lowers):
+            upper = lower + size - 1 if index < len(lowers) - 1 else None
+            partitions.append(BackfillPartition(index, lower, upper, True))
+        return partitions
+    start = datetime.fromisoformat(lowest.replace("Z", "+00:00"))
+    end = datetime.fromisoformat(highest.replace("Z", "+00:00"))
+    step = (end - start) / count
+    for index in range(count):
+        upper = (start + step * (index + 1)).isoformat() if index < count - 1 else None
+        partitions.append(BackfillPartition(index, (start + step * index).isoformat(), upper, False))
+    return partitions
+
+def iter_partition_pages(database, schema, kind, partition):
+    """パーティション内の対象ページを、キーの昇順に (キー, PageRecord) で返す"""
+    path = f"/data_sources/{schema['data_source_id']}/query"
+    properties = schema["properties"]
+    id_property = property_name(database, "ID")
+    projected = [property_name(database, name) for name in PROJECTED_PROPERTIES] + ([id_property] if kind == "id" else [])
+    params = projection_params(properties, projected)
+    target_filter = build_query_filter(database)
+    conditions = [partition.query_filter(kind, id_property, properties.get(id_property, {}).get("type"))]
+    conditions += target_filter["and"] if target_filter else []
+    stats = partition.stats
+    start_cursor = None
+    while True:
+        payload = {"page_size": 100, "sorts": partition_sorts(database, kind, "ascending"), "filter": {"and": conditions}}
+        if start_cursor:
+            payload["start_cursor"] = start_cursor
+        try:
+            response = notion_request(database, "POST", path, params=params, json=payload)
+        except requests.exceptions.RequestException as e:
+            print(f"パーティション {partition.index + 1} の取得に失敗しました: {e}")
+            return
+        stats["request_count"] += 1
+        stats["bytes_received"] += len(response.content)
+        if response.status_code != 200:
+            print(f"パーティション {partition.index + 1} の取得に失敗しました: {response.status_code} - {response.text}")
+            return
+        data = response.json()
+        stats["page_count"] += 1
+        for page in data.get("results", []):
+            key = page_partition_key(database, page, kind)
+            record = to_page_record(page, database)
+            stats["scanned_count"] += 1
+            # 一括処理は全件を処理し直すためのものなので、失敗記録による再試行待ち・除外は適用しない
+            if is_target_page(record):
+                stats["target_count"] += 1
+                partition.start(record.page_id, key)
+                yield key, record
+            partition.scanned(key)
+        if not data.get("has_more"):
+            break
+        start_cursor = data.get("next_cursor")
+    partition.complete_scan()
+
+def load_backfill_checkpoint_file():
+    """一括処理の進捗のファイル（データベースIDごとのエントリ）を読み込む"""
+    try:
+        with open(BACKFILL_CHECKPOINT_PATH, encoding="utf-8") as f:
+            entries = json.load(f)
+        # データベースが1つだけだった頃の形式（進捗がそのまま保存されている）
+        if "partitions" in entries:
+            return {entries.get("database_id"): entries}
+        return entries
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"一括処理の進捗を読み込めなかったため、最初から処理します: {e}")
+        return {}
+
+def load_backfill_checkpoint(database, schema, kind):
+    """同じデータソース・分け方の、完了していない一括処理の進捗を読み込む（なければNone）"""
+    checkpoint = load_backfill_checkpoint_file().get(database.database_id)
+    if (not isinstance(checkpoint, dict) or checkpoint.get("data_source_id") != schema["data_source_id"]
+            or checkpoint.get("kind") != kind or all(partition["done"] for partition in checkpoint.get("partitions", []))):
+        return None
+    return checkpoint
+
+def save_backfill_checkpoint(checkpoint, partitions):
+    """一括処理の進捗（パーティションごとの再開位置）を保存する"""
+    checkpoint["partitions"] = [partition.to_checkpoint() for partition in partitions]
+    checkpoint["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    try:
+        entries = load_backfill_checkpoint_file()
+        entries[checkpoint["database_id"]] = checkpoint
+        write_file_atomic(BACKFILL_CHECKPOINT_PATH, json.dumps(entries, ensure_ascii=False, indent=2))
+    except OSError as e:
+        print(f"一括処理の進捗を保存できませんでした: {e}")
+
+def sum_query_stats(stats_list):
+    """複数のクエリの統計を合計する"""
+    totals = new_query_stats()
+    for stats in stats_list:
+        for key in ("page_count", "scanned_count", "target_count", "request_count", "bytes_received",
+                    "backoff_count", "poisoned_count"):
+            totals[key] += stats[key]
+    totals["completed"] = all(stats["completed"] for stats in stats_list)
+    del totals["first_query_at"]
+    return totals
+
+def sum_partition_stats(partitions):
+    """パーティションごとのクエリの統計を合計する"""
+    totals = sum_query_stats([partition.stats for partition in partitions])
+    totals["completed"] = all(partition.scan_completed for partition in partitions)
+    return totals
+
+def backfill(partitions=BACKFILL_PARTITIONS, restart=False, config_path=SYNC_CONFIG_PATH, database_name=None):
+    """一括処理: データソース全体を分割して並行に取得し、対象ページを全て処理する"""
+    report = {
+        "mode": "backfill",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "status": "error",
+    }
+    started = time.monotonic()
+    try:
+        database = select_database(config_path, database_name, "一括処理")
+        if database is not None:
+            report["database_id"] = database.database_id
+            run_backfill(database, partitions, restart, report)
+    finally:
+        finish_run_report(report, started)
+
+def run_backfill(database, partition_count, restart, report):
+    """一括処理の本体（集計結果は report に書き込む）"""
+    started = time.monotonic()
+    open_run_resources()
+    if retry_queue:
+        drain_retry_queue(database)
+    print(f"データベース: {database_label(database)}")
+    schema = resolve_schema(database)
+    if schema is None:
+        return
+    kind = partition_kind(database, schema["properties"])
+
+    checkpoint = None if restart or not BACKFILL_CHECKPOINT_PATH else load_backfill_checkpoint(database, schema, kind)
+    if checkpoint:
+        partitions = [
+            BackfillPartition(index, item["lower"], item["upper"], item["upper_inclusive"], item["done"])
+            for index, item in enumerate(checkpoint["partitions"])
+        ]
+        print(f"前回の一括処理（{checkpoint['created_at']} 開始）の続きから処理します。")
+    else:
+        bounds = fetch_partition_bounds(database, schema, kind)
+        if bounds is None:
+            print("データソースのページを取得できなかったため、一括処理を終了します。")
+            return
+        partitions = make_partitions(kind, bounds[0], bounds[1], partition_count)
+        checkpoint = {
+            "database_id": database.database_id,
+            "data_source_id": schema["data_source_id"],
+            "kind": kind,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+    label = "ID" if kind == "id" else "作成日時"
+    active = [partition for partition in partitions if not partition.done]
+    print(f"{label}で{len(partitions)}個に分割して処理します（未完了 {len(active)}個）:")
+    for partition in partitions:
+        status = "完了済み" if partition.done else f"{partition.resume_from()} から"
+        print(f"  パーティション {partition.index + 1}: {partition.lower} 〜 {partition.upper or ''}（{status}）")
+
+    # パーティションごとに取得スレッドを動かし、見つかった対象ページを1つのキューにまとめる
+    # Notionへのリクエストはすべて同じレートリミッターを通るため、並行に取得してもレート制限は守られる
+    record_queue = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+    owners = {}
+    owners_lock = threading.Lock()
+    progress = {"processed": 0}
+    stop_scanning = threading.Event()
+
+    def put_record(record):
+        # 処理側が中断した場合に、キューが空くのを待ち続けないようにする
+        while not stop_scanning.is_set():
             try:
-                properties_to_update = {
-                    "あらすじ": {"rich_text": [{"text": {"content": cmoa_data["synopsis"]}}]},
-                    "ジャンル": {"multi_select": [{"name": g} for g in cmoa_data["genres"]]},
-                    "雑誌・レーベル": {"multi_select": [{"name": m} for m in [cmoa_data["magazine"]] if m]},
-                    "タグ": {"multi_select": [{"name": t} for t in cmoa_data["tags"]]}
-                }
+                record_queue.put(record, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-                notion.pages.update(
-                    page_id=page_id,
-                    properties=properties_to_update
-                )
-                print(f"成功: {title} の情報を更新しました。")
-            except Exception as e:
-                print(f"Notionの更新に失敗しました: {e}")
-        else:
-            print(f"データ取得に失敗またはあらすじが空です。")
+    def scan(partition):
+        try:
+            for _, record in iter_partition_pages(database, schema, kind, partition):
+                with owners_lock:
+                    owners[record.page_id] = partition
+                if not put_record(record):
+                    return
+        except Exception as e:
+            print(f"パーティション {partition.index + 1} の取得中にエラーが発生しました: {e}")
+        finally:
+            put_record(None)
 
-        # 次のリクエストまで3秒待機
-        time.sleep(3)
-    
-    print(f"\n処理が完了しました。{len(target_pages['results'])}件のページを処理しました。")
+    def records():
+        remaining = len(active)
+        while remaining:
+            record = record_queue.get()
+            if record is None:
+                remaining -= 1
+            else:
+                yield record
+
+    def on_done(record, result):
+        # 延期したページや一時的な障害で取得できなかったページは処理が終わっていないものとして、次回はそこから再開する
+        with owners_lock:
+            progress["processed"] += 1
+            if result in ("deferred", "retry"):
+                return
+            partition = owners.pop(record.page_id, None)
+        if partition:
+            partition.finish(record.page_id)
+
+    stop_progress = threading.Event()
+
+    def report_progress():
+        while not stop_progress.wait(BACKFILL_PROGRESS_INTERVAL):
+            totals = sum_partition_stats(partitions)
+            elapsed = time.monotonic() - started
+            processed = progress["processed"]
+            print(f"[進捗] 取得 {totals['scanned_count']}件（{totals['scanned_count'] / elapsed:.0f}件/秒）、"
+                  f"対象 {totals['target_count']}件、処理 {processed}件（{processed / elapsed:.2f}件/秒）")
+            if BACKFILL_CHECKPOINT_PATH:
+                save_backfill_checkpoint(checkpoint, partitions)
+
+    scanners = [threading.Thread(target=scan, args=(partition,), daemon=True) for partition in active]
+    for thread in scanners:
+        thread.start()
+    progress_thread = threading.Thread(target=report_progress, daemon=True)
+    progress_thread.start()
+    try:
+        results = run_pipeline(records(), on_done=on_done)
+    finally:
+        stop_progress.set()
+        stop_scanning.set()
+        for thread in scanners:
+            thread.join()
+        if BACKFILL_CHECKPOINT_PATH:
+            save_backfill_checkpoint(checkpoint, partitions)
+    elapsed = time.monotonic() - started
+
+    totals = sum_partition_stats(partitions)
+    remaining = [partition for partition in partitions if not partition.to_checkpoint()["done"]]
+    report["partitions"] = checkpoint["partitions"]
+    report["query"] = totals
+    report["pages"] = {key: results[key] for key in ("processed", "succeeded", "failed", "deferred", "retry", "rejected")}
+    report["throughput"] = {
+        "scanned_per_second": round(totals["scanned_count"] / elapsed, 2) if elapsed > 0 else 0,
+        "processed_per_second": round(results["processed"] / elapsed, 3) if elapsed > 0 else 0,
+        "updated_per_second": round(results["succeeded"] / elapsed, 3) if elapsed > 0 else 0,
+    }
+    report["scrape_cache"] = dict(scrape_cache.stats) if scrape_cache else None
+    report["scrape_dedup"] = scrape_dedup.report()
+    report["notion"] = dict(notion_stats)
+    report["connections"] = connection_stats()
+    report["circuit_breakers"] = circuit_breaker_stats()
+    report["status"] = "ok" if not remaining else "partial"
+
+    print(f"\n一括処理が{'完了しました' if not remaining else '途中で終了しました'}。処理時間: {elapsed:.1f}秒")
+    print(f"取得: {totals['scanned_count']}件（{report['throughput']['scanned_per_second']}件/秒、"
+          f"リクエスト {totals['request_count']}回、{totals['bytes_received'] / 1024:.1f}KB）")
+    print(f"処理: {results['processed']}件（{report['throughput']['processed_per_second']}件/秒）、"
+          f"成功: {results['succeeded']}件（{report['throughput']['updated_per_second']}件/秒）、"
+          f"失敗: {results['failed']}件、延期: {results['deferred']}件、一時的な障害: {results['retry']}件、"
+          f"更新を諦めた: {results['rejected']}件")
+    print_dedup_summary(report["scrape_dedup"])
+    if remaining:
+        print(f"未完了のパーティションが{len(remaining)}個あります。もう一度 backfill を実行すると続きから処理します。")
+    if scrape_cache:
+        scrape_cache.close()
 
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="コミックシーモアの作品情報をNotionデータベースに反映する")
+    arg_parser.add_argument("command", nargs="?", default="sync", choices=["sync", "serve", "backfill"],
+                            help="sync: 1回同期して終了する（既定） / serve: 常駐して定期的に同期する / "
+                                 "backfill: データソース全体を分割して並行に処理する")
+    arg_parser.add_argument("--full-scan", action="store_true", help="前回の同期時刻に関係なく全件をチェックする")
+    arg_parser.add_argument("--partitions", type=int, default=BACKFILL_PARTITIONS,
+                            help=f"backfill で分割するパーティションの数（既定: {BACKFILL_PARTITIONS}）")
+    arg_parser.add_argument("--restart", action="store_true", help="backfill の進捗を破棄して最初から処理する")
+    arg_parser.add_argument("--config", default=SYNC_CONFIG_PATH, metavar="PATH",
+                            help="同期する複数のデータベースを指定する設定ファイル（JSON。既定: 環境変数 SYNC_CONFIG_PATH）")
+    arg_parser.add_argument("--database", metavar="NAME",
+                            help="設定ファイルのうち、このデータベース（名前またはID）だけを処理する")
+    arg_parser.add_argument("--reset-scrape-failures", action="store_true",
+                            help="取得に失敗し続けて再試行待ち・除外になっているURLの記録を削除してから実行する")
+    arg_parser.add_argument("--profile", nargs="?", const=PROFILE_PATH, metavar="PATH",
+                            help=f"cProfileで計測し、結果をファイルに保存する（既定: {PROFILE_PATH}）")
+    args = arg_parser.parse_args()
+    full_scan = args.full_scan or os.getenv("SYNC_FULL_SCAN") == "1"
+    if args.reset_scrape_failures or os.getenv("SCRAPE_FAILURE_RESET") == "1":
+        reset_scrape_failures()
+    if args.command == "backfill":
+        entry_point, kwargs = backfill, {"partitions": args.partitions, "restart": args.restart}
+    else:
+        entry_point, kwargs = (serve if args.command == "serve" else main), {"full_scan": full_scan}
+    kwargs.update(config_path=args.config, database_name=args.database)
+    if args.profile:
+        run_with_profile(args.profile, entry_point, **kwargs)
+    else:
+        entry_point(**kwargs)